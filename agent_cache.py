@@ -0,0 +1,37 @@
+import json
+
+from sqlite_cache import SQLiteCache
+
+AGENT_CACHE_FILE = 'agent_answers.sqlite3'
+
+
+def normalize_question(question):
+    return ' '.join(question.casefold().split())
+
+
+class AgentAnswerCache:
+    """
+    Persistent cache of LLM agent answers keyed on a DataFrame fingerprint
+    (see data_loader.dataframe_fingerprint) and the normalized question, so
+    one dataset never pays for the same agent question twice.
+    """
+
+    def __init__(self, path=AGENT_CACHE_FILE, ttl=None, max_entries=10000):
+        self._store = SQLiteCache(path, table='agent_answers', ttl=ttl, max_entries=max_entries)
+
+    def _key(self, fingerprint, question):
+        return json.dumps([fingerprint, normalize_question(question)])
+
+    def get(self, fingerprint, question):
+        return self._store.get(self._key(fingerprint, question))
+
+    def set(self, fingerprint, question, answer):
+        self._store.set(self._key(fingerprint, question), answer)
+
+    def get_or_run(self, fingerprint, question, run):
+        """Return the cached answer, or run(question) and cache its result."""
+        answer = self.get(fingerprint, question)
+        if answer is None:
+            answer = run(question)
+            self.set(fingerprint, question, answer)
+        return answer
@@ -1,12 +1,20 @@
 #Import required libraries
+import functools
 import os 
 from apikey import apikey 
 
 import streamlit as st
 import pandas as pd
+from agent_cache import AgentAnswerCache
+from completion_cache import CompletionCache
+from data_loader import dataframe_fingerprint, load_dataframe
+from eda_runner import fill_slots, question_slots
+from instrumentation import Metrics, render_metrics_panel
+from local_eda import correlations, duplicate_rows, missing_values, narration_prompt, outliers, variable_summary
 
 import openai
 from langchain.agents import create_pandas_dataframe_agent
+from langchain.callbacks import get_openai_callback
 from dotenv import load_dotenv, find_dotenv
 
 #OpenAIKey
@@ -33,6 +41,21 @@ with st.sidebar:
 
     st.caption("<p style ='text-align:center'> made with ❤️ by Ana</p>",unsafe_allow_html=True )
 
+#Agent answers cached on disk by dataframe fingerprint and question
+@st.cache_resource
+def get_answer_cache():
+    return AgentAnswerCache()
+
+#Deterministic completions cached on disk across restarts
+@st.cache_resource
+def get_completion_cache():
+    return CompletionCache()
+
+#Call metrics shared across reruns and sessions, see instrumentation.Metrics.from_env
+@st.cache_resource
+def get_metrics():
+    return Metrics.from_env()
+
 #Initialise the key in session state
 if 'clicked' not in st.session_state:
     st.session_state.clicked ={1:False}
@@ -45,7 +68,9 @@ if st.session_state.clicked[1]:
     user_csv = st.file_uploader("Upload your file here", type="csv")
     if user_csv is not None:
         user_csv.seek(0)
-        df = pd.read_csv(user_csv, low_memory=False)
+        # Streamed in chunks with downcast numerics and categoricals for repeated strings
+        df, load_stats = load_dataframe(user_csv)
+        df_fingerprint = dataframe_fingerprint(df)
 
         #llm model
         llm = OpenAI(temperature = 0)
@@ -53,53 +78,109 @@ if st.session_state.clicked[1]:
         #Function sidebar
         @st.cache_data
         def steps_eda():
-            steps_eda = llm('What are the steps of EDA')
-            return steps_eda
+            response = get_metrics().completion(
+                'steps_eda',
+                functools.partial(get_completion_cache().create, openai),
+                model='gpt-4o-mini',
+                messages=[{"role": "user", "content": 'What are the steps of EDA'}],
+                temperature=0,
+            )
+            return response.choices[0].message.content
 
         #Pandas agent
         pandas_agent = create_pandas_dataframe_agent(llm, df, verbose = True)
 
+        #Answer from the cache or run, recording time, token usage and cache hits
+        def metered_answer(name, prompt, run):
+            with get_metrics().timed(name, payload_bytes=len(prompt.encode('utf-8'))) as event:
+                event['cache_hit'] = True
+                def metered_run(prompt):
+                    event['cache_hit'] = False
+                    with get_openai_callback() as usage:
+                        answer = run(prompt)
+                    event.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+                    return answer
+                return get_answer_cache().get_or_run(df_fingerprint, prompt, metered_run)
+
+        #Ask the agent, reusing any earlier answer for this dataframe and question
+        def ask_agent(question):
+            return metered_answer('pandas_agent', question, pandas_agent.run)
+
+        #Have the llm narrate results computed locally, the prompt carries the numbers
+        def narrate(prompt):
+            return metered_answer('llm_narration', prompt, llm)
+
+        #Questions answered by the agent, everything else is a narration prompt.
+        #The agent's Python REPL and state over the shared df aren't thread-safe,
+        #so its questions run one at a time while the stateless llm narrations run concurrently
+        agent_questions = set()
+
+        def answer(question):
+            return ask_agent(question) if question in agent_questions else narrate(question)
+
+        def agent_slots(questions):
+            agent_questions.update(questions)
+            return question_slots(questions)
+
+        def narration_slots(topic, results):
+            return question_slots([narration_prompt(topic, results)], labels=[topic])
+
         #Functions main
-        @st.cache_data
         def function_agent():
             st.write("**Data Overview**")
             st.write("The first rows of your dataset look like this:")
             st.write(df.head())
+            # Computable sections are calculated here, the llm only narrates their results.
+            # Placeholders keep the page order while the llm questions run concurrently.
             st.write("**Data Cleaning**")
-            columns_df = pandas_agent.run("What are the meaning of the columns?")
-            st.write(columns_df)
-            missing_values = pandas_agent.run("How many missing values does this dataframe have? Start the answer with 'There are'")
-            st.write(missing_values)
-            duplicates = pandas_agent.run("Are there any duplicate values and if so where?")
-            st.write(duplicates)
+            slots = agent_slots(["What are the meaning of the columns?"])
+            missing = missing_values(df)
+            st.write(pd.Series(missing["by_column"], name="Missing values", dtype="int64"))
+            slots.update(narration_slots("how many missing values this dataframe has, starting the answer with 'There are'", missing))
+            duplicates = duplicate_rows(df)
+            slots.update(narration_slots("whether there are duplicate rows and where they are", duplicates))
             st.write("**Data Summarisation**")
             st.write(df.describe())
-            correlation_analysis = pandas_agent.run("Calculate correlations between numerical variables to identify potential relationships.")
-            st.write(correlation_analysis)
-            outliers = pandas_agent.run("Identify outliers in the data that may be erroneous or that may have a significant impact on the analysis.")
-            st.write(outliers)
-            new_features = pandas_agent.run("What new features would be interesting to create?.")
-            st.write(new_features)
+            correlation_results = correlations(df)
+            st.write(pd.DataFrame(correlation_results["matrix"]))
+            slots.update(narration_slots(
+                "the correlations between numerical variables and the potential relationships they suggest",
+                correlation_results["strongest_pairs"],
+            ))
+            outlier_results = outliers(df)
+            st.write(pd.DataFrame(outlier_results).T)
+            slots.update(narration_slots(
+                "the outliers that may be erroneous or may have a significant impact on the analysis",
+                outlier_results,
+            ))
+            slots.update(agent_slots(["What new features would be interesting to create?."]))
+            fill_slots(slots, answer, serial=agent_questions)
             return
 
-        @st.cache_data
-        def function_question_variable():
+        def function_question_variable(user_question_variable):
             st.line_chart(df, y =[user_question_variable])
-            summary_statistics = pandas_agent.run(f"Give me a summary of the statistics of {user_question_variable}")
-            st.write(summary_statistics)
-            normality = pandas_agent.run(f"Check for normality or specific distribution shapes of {user_question_variable}")
-            st.write(normality)
-            outliers = pandas_agent.run(f"Assess the presence of outliers of {user_question_variable}")
-            st.write(outliers)
-            trends = pandas_agent.run(f"Analyse trends, seasonality, and cyclic patterns of {user_question_variable}")
-            st.write(trends)
-            missing_values = pandas_agent.run(f"Determine the extent of missing values of {user_question_variable}")
-            st.write(missing_values)
+            variable = df[user_question_variable]
+            variable_results = variable_summary(variable)
+            slots = narration_slots(f"the summary statistics of {user_question_variable}", variable_results)
+            if "normality" in variable_results:
+                slots.update(narration_slots(
+                    f"whether {user_question_variable} looks normally distributed or has another distribution shape",
+                    variable_results["normality"],
+                ))
+                slots.update(narration_slots(
+                    f"the presence of outliers in {user_question_variable}",
+                    outliers(df[[user_question_variable]]),
+                ))
+            slots.update(agent_slots([f"Analyse trends, seasonality, and cyclic patterns of {user_question_variable}"]))
+            slots.update(narration_slots(
+                f"the extent of missing values of {user_question_variable}",
+                {"missing": variable_results["missing"], "rows": len(variable)},
+            ))
+            fill_slots(slots, answer, serial=agent_questions)
             return
         
-        @st.cache_data
-        def function_question_dataframe():
-            dataframe_info = pandas_agent.run(user_question_dataframe)
+        def function_question_dataframe(user_question_dataframe):
+            dataframe_info = ask_agent(user_question_dataframe)
             st.write(dataframe_info)
             return
 
@@ -117,13 +198,15 @@ if st.session_state.clicked[1]:
         st.subheader('Variable of study')
         user_question_variable = st.text_input('What variable are you interested in')
         if user_question_variable is not None and user_question_variable !="":
-            function_question_variable()
+            function_question_variable(user_question_variable)
 
             st.subheader('Further study')
 
         if user_question_variable:
             user_question_dataframe = st.text_input( "Is there anything else you would like to know about your dataframe?")
             if user_question_dataframe is not None and user_question_dataframe not in ("","no","No"):
-                function_question_dataframe()
+                function_question_dataframe(user_question_dataframe)
             if user_question_dataframe in ("no", "No"):
                 st.write("")
+
+        render_metrics_panel(get_metrics(), cache_stats={'Completion cache': get_completion_cache().stats()})
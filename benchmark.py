@@ -0,0 +1,388 @@
+"""
+Offline benchmarks for the chat, search and data-analysis pipelines.
+
+    python benchmark.py                              # run everything, print a report
+    python benchmark.py --quick --cases load_csv     # smallest sizes of one case
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json   # exit 1 on regressions
+
+Every case runs at increasing sizes (messages in the history, rows in the
+file) in a fresh process, so its peak RSS is its own. Search and OpenAI
+calls go to stub_server on localhost with --latency seconds of delay.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from stub_server import DEFAULT_LATENCY, DEFAULT_TOKEN_DELAY, server_urls, start_stub_server
+
+DEFAULT_REPEAT = 5
+REGRESSION_TOLERANCE = 0.2
+# Timing differences below this are noise, not regressions
+MIN_REGRESSION_SECONDS = 0.002
+MODEL = 'gpt-4o-mini'
+
+
+def synthetic_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'id': np.arange(rows),
+        'region': rng.choice(['north', 'south', 'east', 'west'], rows),
+        'city': rng.choice([f"city_{i}" for i in range(100)], rows),
+        'amount': rng.normal(100, 25, rows).round(2),
+        'quantity': rng.integers(1, 50, rows),
+        'ordered_at': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 24 * 3600, rows), unit='s'),
+        'note': rng.choice(['', 'rush order', 'gift', 'returned item, refunded'], rows),
+    })
+    df.loc[rng.random(rows) < 0.05, 'amount'] = np.nan
+    return df
+
+
+def synthetic_history(messages, seed=0):
+    rng = np.random.default_rng(seed)
+    history = [{'role': 'system', 'content': 'You are an investment analyzer.'}]
+    for i in range(messages):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        words = int(rng.integers(10, 200))
+        history.append({'role': role, 'content': ' '.join(f"token{j}" for j in range(words))})
+    return history
+
+
+class NamedBytesIO(io.BytesIO):
+    """An in-memory upload, like Streamlit's UploadedFile."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def _data_file(workdir, rows, kind):
+    path = os.path.join(workdir, f"synthetic_{rows}.{kind}")
+    if not os.path.exists(path):
+        df = synthetic_frame(rows)
+        if kind == 'csv':
+            df.to_csv(path, index=False)
+        else:
+            df.to_excel(path, index=False)
+    return path
+
+
+def _upload(path):
+    with open(path, 'rb') as file:
+        return NamedBytesIO(file.read(), os.path.basename(path))
+
+
+def _timed(call, repeat):
+    durations = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - started_at)
+    return durations
+
+
+# Each case takes (size, repeat, workdir) and returns (durations, items per call)
+
+def bench_chat_store_rerun(size, repeat, workdir):
+    # What a rerun costs the chat apps: load the session, append one message
+    from chat_store import ChatStore
+    store = ChatStore(os.path.join(workdir, f"chat_db_{size}_{os.getpid()}"))
+    store.create_session('bench', synthetic_history(size))
+    store.load_session('bench')
+
+    def rerun():
+        store.load_session('bench')
+        store.append_message('bench', {'role': 'user', 'content': 'one more question'})
+    return _timed(rerun, repeat), size
+
+
+def bench_chat_store_cold_load(size, repeat, workdir):
+    # First load after a restart, nothing cached in memory
+    from chat_store import ChatStore
+    root = os.path.join(workdir, f"chat_db_cold_{size}_{os.getpid()}")
+    ChatStore(root).create_session('bench', synthetic_history(size))
+    return _timed(lambda: ChatStore(root).load_session('bench'), repeat), size
+
+
+def bench_build_messages(size, repeat, workdir):
+    from context_window import build_messages, with_token_count
+    history = [with_token_count(message) for message in synthetic_history(size)]
+    return _timed(lambda: build_messages(history, MODEL), repeat), size
+
+
+def bench_live_web_search(size, repeat, workdir):
+    # size distinct queries per call, all cache misses served by the stub
+    import chatgpt_search_engine_v3 as app
+    counter = iter(range(10 ** 9))
+
+    def search():
+        for _ in range(size):
+            app.live_web_search(f"query {os.getpid()} {next(counter)}", 'key', 'cse', excluded_domains=['reddit.com'])
+    return _timed(search, repeat), size
+
+
+def bench_live_web_search_cached(size, repeat, workdir):
+    import chatgpt_search_engine_v3 as app
+    queries = [f"cached query {i}" for i in range(size)]
+    for query in queries:
+        app.live_web_search(query, 'key', 'cse', excluded_domains=['reddit.com'])
+
+    def search():
+        for query in queries:
+            app.live_web_search(query, 'key', 'cse', excluded_domains=['reddit.com'])
+    return _timed(search, repeat), size
+
+
+def _stub_results(size, prefix):
+    # Search results linking to size pages served by the stub
+    base_url = os.environ['GOOGLE_SEARCH_URL'].rsplit('/customsearch', 1)[0]
+    return [{'link': f"{base_url}/pages/{prefix}/{i}", 'title': f"Page {i}", 'snippet': ''} for i in range(size)]
+
+
+def _stub_fetch(url):
+    # The stub server is on localhost, which fetch_page refuses by default
+    from retrieval import fetch_page
+    return fetch_page(url, allow_private=True)
+
+
+def bench_retrieve(size, repeat, workdir):
+    # size pages fetched, chunked and embedded from scratch, then ranked
+    from retrieval import HashingEmbedder, Retriever
+    embed = HashingEmbedder()
+    roots = iter(range(repeat))
+
+    def retrieve():
+        retriever = Retriever(os.path.join(workdir, f"retrieval_{os.getpid()}_{next(roots)}"), fetch=_stub_fetch)
+        retriever.retrieve('term3 term10 outlook', _stub_results(size, os.getpid()), embed)
+    return _timed(retrieve, repeat), size
+
+
+def bench_retrieve_cached(size, repeat, workdir):
+    from retrieval import HashingEmbedder, Retriever
+    embed = HashingEmbedder()
+    retriever = Retriever(os.path.join(workdir, f"retrieval_{os.getpid()}"), fetch=_stub_fetch)
+    results = _stub_results(size, os.getpid())
+    retriever.retrieve('term3 term10 outlook', results, embed)
+    return _timed(lambda: retriever.retrieve('term3 term10 outlook', results, embed), repeat), size
+
+
+def bench_chat_completion_stream(size, repeat, workdir):
+    # A streamed answer to a size-message history, read to the end
+    from context_window import build_messages
+    from openai_clients import OpenAIClientRegistry
+    client = OpenAIClientRegistry().get('sk-bench')
+    messages = build_messages(synthetic_history(size), MODEL)
+
+    def complete():
+        stream = client.chat.completions.create(model=MODEL, messages=messages, stream=True)
+        for _ in stream:
+            pass
+    return _timed(complete, repeat), size
+
+
+def bench_load_csv(size, repeat, workdir):
+    from data_loader import load_dataframe
+    path = _data_file(workdir, size, 'csv')
+    return _timed(lambda: load_dataframe(_upload(path)), repeat), size
+
+
+def bench_load_excel(size, repeat, workdir):
+    # Cold parse into a fresh workbook cache each time
+    from workbook_cache import WorkbookCache
+    data = _upload(_data_file(workdir, size, 'xlsx')).getvalue()
+    roots = iter(range(repeat))
+
+    def load():
+        cache = WorkbookCache(os.path.join(workdir, f"workbooks_{os.getpid()}_{next(roots)}"))
+        cache.load_sheet(data, cache.sheet_names(data)[0])
+    return _timed(load, repeat), size
+
+
+def bench_load_excel_cached(size, repeat, workdir):
+    from workbook_cache import WorkbookCache
+    data = _upload(_data_file(workdir, size, 'xlsx')).getvalue()
+    cache = WorkbookCache(os.path.join(workdir, f"workbooks_{os.getpid()}"))
+    sheet_name = cache.sheet_names(data)[0]
+    cache.load_sheet(data, sheet_name)
+    return _timed(lambda: cache.load_sheet(data, sheet_name), repeat), size
+
+
+def bench_profile_csv(size, repeat, workdir):
+    from profiler import profile_file
+    path = _data_file(workdir, size, 'csv')
+    return _timed(lambda: profile_file(path).summary(), repeat), size
+
+
+def bench_serialize_dataframe(size, repeat, workdir):
+    from prompt_serializer import serialize_dataframe
+    df = synthetic_frame(size)
+    return _timed(lambda: serialize_dataframe(df), repeat), size
+
+
+# name -> (function, sizes, quick sizes, unit)
+CASES = {
+    'chat_store_rerun': (bench_chat_store_rerun, [100, 1_000, 10_000], [100, 1_000], 'messages'),
+    'chat_store_cold_load': (bench_chat_store_cold_load, [100, 1_000, 10_000], [100, 1_000], 'messages'),
+    'build_messages': (bench_build_messages, [100, 1_000, 10_000], [100, 1_000], 'messages'),
+    'live_web_search': (bench_live_web_search, [1, 10], [1], 'queries'),
+    'live_web_search_cached': (bench_live_web_search_cached, [1, 10], [1], 'queries'),
+    'retrieve': (bench_retrieve, [10, 20], [10], 'pages'),
+    'retrieve_cached': (bench_retrieve_cached, [10, 20], [10], 'pages'),
+    'chat_completion_stream': (bench_chat_completion_stream, [10, 100], [10], 'messages'),
+    'load_csv': (bench_load_csv, [10_000, 100_000, 1_000_000], [10_000, 100_000], 'rows'),
+    'load_excel': (bench_load_excel, [1_000, 10_000, 50_000], [1_000, 10_000], 'rows'),
+    'load_excel_cached': (bench_load_excel_cached, [1_000, 10_000, 50_000], [1_000, 10_000], 'rows'),
+    'profile_csv': (bench_profile_csv, [10_000, 100_000, 1_000_000], [10_000, 100_000], 'rows'),
+    'serialize_dataframe': (bench_serialize_dataframe, [10_000, 100_000, 1_000_000], [10_000, 100_000], 'rows'),
+}
+
+
+def _peak_rss_bytes():
+    # VmHWM belongs to this process image; ru_maxrss can carry over the
+    # parent's peak across fork and exec
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        # Windows has neither /proc nor resource
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q * 100))
+
+
+def _run_case(name, size, repeat, workdir, env):
+    # Runs in a fresh worker process, so ru_maxrss is this case's peak RSS
+    os.environ.update(env)
+    os.chdir(workdir)
+    function, _, _, unit = CASES[name]
+    durations, items = function(size, repeat, workdir)
+    p50 = _percentile(durations, 0.5)
+    peak_rss = _peak_rss_bytes()
+    return {
+        'case': name,
+        'size': size,
+        'unit': unit,
+        'repeat': repeat,
+        'p50 (s)': round(p50, 6),
+        'max (s)': round(max(durations), 6),
+        'mean (s)': round(statistics.fmean(durations), 6),
+        'throughput (/s)': round(items / p50, 1) if p50 > 0 else None,
+        'peak RSS (MB)': round(peak_rss / 1024 ** 2, 1) if peak_rss is not None else None,
+    }
+
+
+def run_benchmarks(cases, quick=False, repeat=DEFAULT_REPEAT, latency=DEFAULT_LATENCY,
+                   token_delay=DEFAULT_TOKEN_DELAY, workdir=None):
+    server = start_stub_server(latency=latency, token_delay=token_delay)
+    env = server_urls(server)
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix='bench_'))
+    os.makedirs(workdir, exist_ok=True)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    try:
+        for name in cases:
+            _, sizes, quick_sizes, _ = CASES[name]
+            for size in quick_sizes if quick else sizes:
+                # Synthetic files are written once, outside the measured process
+                if name in ('load_csv', 'profile_csv'):
+                    _data_file(workdir, size, 'csv')
+                elif name.startswith('load_excel'):
+                    _data_file(workdir, size, 'xlsx')
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    result = executor.submit(_run_case, name, size, repeat, workdir, env).result()
+                print(format_row(result), flush=True)
+                results.append(result)
+    finally:
+        server.shutdown()
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'latency': latency,
+        'results': results,
+    }
+
+
+def format_row(result):
+    rss = result['peak RSS (MB)']
+    return (
+        f"{result['case']:<24} {result['size']:>10,} {result['unit']:<9}"
+        f" p50 {result['p50 (s)'] * 1000:>10.2f} ms  max {result['max (s)'] * 1000:>10.2f} ms"
+        f"  {result['throughput (/s)'] or 0:>12,.1f}/s  RSS {f'{rss:>8.1f}' if rss is not None else 'n/a':>8} MB"
+    )
+
+
+def compare(run, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Results slower or heavier than the baseline by more than tolerance, as messages."""
+    baseline_results = {(result['case'], result['size']): result for result in baseline['results']}
+    regressions = []
+    for result in run['results']:
+        base = baseline_results.get((result['case'], result['size']))
+        if base is None:
+            continue
+        label = f"{result['case']}[{result['size']:,}]"
+        p50, base_p50 = result['p50 (s)'], base['p50 (s)']
+        if p50 > base_p50 * (1 + tolerance) and p50 - base_p50 > MIN_REGRESSION_SECONDS:
+            regressions.append(f"{label}: p50 {base_p50 * 1000:.2f} ms -> {p50 * 1000:.2f} ms")
+        rss, base_rss = result['peak RSS (MB)'], base['peak RSS (MB)']
+        if rss is not None and base_rss is not None and rss > base_rss * (1 + tolerance):
+            regressions.append(f"{label}: peak RSS {base_rss:.1f} MB -> {rss:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--quick', action='store_true', help='only the smaller sizes')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help='stub server delay in seconds')
+    parser.add_argument('--token-delay', type=float, default=DEFAULT_TOKEN_DELAY)
+    parser.add_argument('--workdir', help='where synthetic files and stores go, a temp dir by default')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--save-baseline', help='write the results as the new baseline')
+    parser.add_argument('--baseline', help='compare against this baseline, exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    run = run_benchmarks(args.cases, args.quick, args.repeat, args.latency, args.token_delay, args.workdir)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as file:
+                json.dump(run, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare(run, baseline, args.tolerance)
+        if regressions:
+            print('\nRegressions against the baseline:')
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print('\nNo regressions against the baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
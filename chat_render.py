@@ -0,0 +1,45 @@
+import streamlit as st
+
+PAGE_SIZE = 30
+
+
+def message_markdown(message):
+    """
+    Markdown body for a stored message. Sources are folded into the same
+    body to keep it to one element per message.
+    """
+    sources = message.get("sources")
+    if not sources:
+        return message["content"]
+    source_lines = "\n".join(f"- [{source}]({source})" for source in sources)
+    return f"{message['content']}\n\n**Sources:**\n{source_lines}"
+
+
+def _show_older(state_key, page_size):
+    st.session_state[state_key] += page_size
+
+
+def render_chat_history(messages, key, page_size=PAGE_SIZE):
+    """
+    Render only the most recent page_size messages of a chat, with a
+    "Load older messages" button that pages further back. System messages
+    are never shown. The window is remembered per key (e.g. per session).
+    """
+    visible = [message for message in messages if message["role"] != "system"]
+    state_key = f"chat_window_{key}"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = page_size
+    limit = st.session_state[state_key]
+
+    hidden = len(visible) - limit
+    if hidden > 0:
+        st.button(
+            f"Load older messages ({hidden} hidden)",
+            key=f"{state_key}_older",
+            on_click=_show_older,
+            args=(state_key, page_size),
+        )
+
+    for message in visible[-limit:]:
+        with st.chat_message(message["role"]):
+            st.markdown(message_markdown(message))
@@ -0,0 +1,249 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl, fall back to the in-process lock only
+    fcntl = None
+
+DB_DIR = 'chat_db'
+INDEX_FILE = 'index.json'
+SESSIONS_DIR = 'sessions'
+FLUSH_INTERVAL = 0.5
+
+
+class ChatStore:
+    """
+    Append-only chat storage: one JSONL log per session plus a small index
+    holding the session names and stored OpenAI API keys.
+
+    Saving a message appends a single line to that session's log instead of
+    rewriting every session in db.json.
+
+    Parsed sessions and the index are kept in memory and revalidated against
+    the files' mtime and size, so a rerun that doesn't touch history costs a
+    stat() rather than a read and parse. With write_behind=True appends are
+    buffered and flushed in batches by a background thread (and at exit).
+    """
+
+    def __init__(self, root=DB_DIR, legacy_db_file=None, write_behind=False, flush_interval=FLUSH_INTERVAL):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self.sessions_path = os.path.join(root, SESSIONS_DIR)
+        self._lock = threading.RLock()
+        self._index_cache = None
+        self._session_cache = {}
+        self._pending = {}
+        os.makedirs(self.sessions_path, exist_ok=True)
+        if not os.path.exists(self.index_path):
+            self._migrate(legacy_db_file)
+
+        self.write_behind = write_behind
+        if write_behind:
+            self.flush_interval = flush_interval
+            self._flush_requested = threading.Event()
+            self._closed = False
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    # Cache validation
+    def _stat_key(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    # Index handling
+    def _read_index(self):
+        with self._lock:
+            stat_key = self._stat_key(self.index_path)
+            if self._index_cache is None or self._index_cache[0] != stat_key:
+                with open(self.index_path, 'r') as file:
+                    index = json.load(file)
+                index.setdefault('openai_api_keys', [])
+                index.setdefault('sessions', {})
+                self._index_cache = (stat_key, index)
+            index = self._index_cache[1]
+            # Callers mutate what they get back, so hand out a copy
+            return {'openai_api_keys': list(index['openai_api_keys']), 'sessions': dict(index['sessions'])}
+
+    def _write_index(self, index):
+        with self._lock:
+            self._atomic_write(self.index_path, json.dumps(index))
+            self._index_cache = (self._stat_key(self.index_path), index)
+
+    def _atomic_write(self, path, text):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+    def _session_file(self, file_id):
+        return os.path.join(self.sessions_path, f"{file_id}.jsonl")
+
+    def _file_id(self, name):
+        file_id = self._read_index()['sessions'].get(name)
+        if file_id is None:
+            raise KeyError(name)
+        return file_id
+
+    # One-time import of the old single-file db.json layout
+    def _migrate(self, legacy_db_file):
+        index = {'openai_api_keys': [], 'sessions': {}}
+        if legacy_db_file and os.path.exists(legacy_db_file):
+            with open(legacy_db_file, 'r') as file:
+                legacy = json.load(file)
+            index['openai_api_keys'] = list(legacy.get('openai_api_keys', []))
+            for name, messages in legacy.get('chat_sessions', {}).items():
+                file_id = uuid.uuid4().hex
+                self._write_messages(self._session_file(file_id), messages)
+                index['sessions'][name] = file_id
+        # The index is written last so an interrupted migration is retried
+        self._write_index(index)
+
+    def _write_messages(self, path, messages):
+        with self._lock:
+            self._atomic_write(path, ''.join(json.dumps(m) + '\n' for m in messages))
+            self._session_cache[path] = (self._stat_key(path), list(messages))
+
+    # API keys
+    def api_keys(self):
+        return self._read_index()['openai_api_keys']
+
+    def add_api_key(self, api_key):
+        with self._lock:
+            index = self._read_index()
+            if api_key not in index['openai_api_keys']:
+                index['openai_api_keys'].append(api_key)
+                self._write_index(index)
+
+    # Sessions
+    def session_names(self):
+        return list(self._read_index()['sessions'].keys())
+
+    def has_session(self, name):
+        return name in self._read_index()['sessions']
+
+    def load_session(self, name):
+        path = self._session_file(self._file_id(name))
+        with self._lock:
+            stat_key = self._stat_key(path)
+            cached = self._session_cache.get(path)
+            if cached is None or cached[0] != stat_key:
+                cached = (stat_key, self._read_messages(path))
+                self._session_cache[path] = cached
+            # Unflushed write-behind appends are served from memory
+            return cached[1] + self._pending.get(path, [])
+
+    def _read_messages(self, path):
+        messages = []
+        if not os.path.exists(path):
+            return messages
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    messages.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn trailing line from an interrupted append is ignored
+                    continue
+        return messages
+
+    def create_session(self, name, messages=None):
+        with self._lock:
+            index = self._read_index()
+            if name in index['sessions']:
+                raise ValueError(f"Session '{name}' already exists.")
+            file_id = uuid.uuid4().hex
+            self._write_messages(self._session_file(file_id), messages or [])
+            index['sessions'][name] = file_id
+            self._write_index(index)
+
+    def append_message(self, name, message):
+        path = self._session_file(self._file_id(name))
+        with self._lock:
+            if self.write_behind:
+                self._pending.setdefault(path, []).append(message)
+                self._flush_requested.set()
+            else:
+                self._append_lines(path, [message])
+
+    def _append_lines(self, path, messages):
+        data = ''.join(json.dumps(m) + '\n' for m in messages).encode('utf-8')
+        with self._lock:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                before = os.fstat(fd)
+                os.write(fd, data)
+                after = os.fstat(fd)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            cached = self._session_cache.get(path)
+            if cached is not None and cached[0] == (before.st_mtime_ns, before.st_size):
+                # Extend the cached history instead of reparsing the log
+                self._session_cache[path] = ((after.st_mtime_ns, after.st_size), cached[1] + list(messages))
+            else:
+                # Not loaded yet, or another process appended in between
+                self._session_cache.pop(path, None)
+
+    # Write-behind flushing
+    def _flush_loop(self):
+        while not self._closed:
+            self._flush_requested.wait()
+            # Give the rest of the turn a moment so its messages share one write
+            self._flush_requested.clear()
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for path, messages in pending.items():
+                self._append_lines(path, messages)
+
+    def close(self):
+        if self.write_behind and not self._closed:
+            self._closed = True
+            self._flush_requested.set()
+        self.flush()
+
+    def reset_session(self, name, messages=None):
+        # Clearing a chat rewrites only that session's log
+        with self._lock:
+            path = self._session_file(self._file_id(name))
+            self._pending.pop(path, None)
+            self._write_messages(path, messages or [])
+
+    def rename_session(self, old_name, new_name):
+        with self._lock:
+            index = self._read_index()
+            if new_name in index['sessions']:
+                raise ValueError(f"Session '{new_name}' already exists.")
+            # Rebuild the mapping so the renamed session keeps its position
+            index['sessions'] = {
+                (new_name if name == old_name else name): file_id
+                for name, file_id in index['sessions'].items()
+            }
+            self._write_index(index)
+
+    def delete_session(self, name):
+        with self._lock:
+            index = self._read_index()
+            file_id = index['sessions'].pop(name)
+            self._write_index(index)
+            path = self._session_file(file_id)
+            self._pending.pop(path, None)
+            self._session_cache.pop(path, None)
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,38 +1,76 @@
+import functools
 import openai
 import requests
+import http_client
 import streamlit as st
+from completion_cache import CompletionCache
+from instrumentation import Metrics, render_metrics_panel
+from key_validation import KeyValidationCache
+from openai_clients import OpenAIClientRegistry
+from streaming import TurnTimer
+
+# Deterministic completions cached on disk, replayed as a stream on a hit
+@st.cache_resource
+def get_completion_cache():
+    return CompletionCache()
+
+# Pooled OpenAI clients, one per API key, shared across reruns and sessions
+@st.cache_resource
+def get_openai_clients():
+    return OpenAIClientRegistry()
+
+# Call metrics shared across reruns and sessions, see instrumentation.Metrics.from_env
+@st.cache_resource
+def get_metrics():
+    return Metrics.from_env()
+
+# Key validation results shared across reruns and sessions, keyed on salted key hashes
+@st.cache_resource
+def get_key_validation_cache():
+    return KeyValidationCache()
 
 # Function to validate OpenAI API key
 def validate_openai_api_key(api_key):
     try:
-        openai.api_key = api_key
         # Perform a simple API call to validate the key
-        openai.models.list()
+        get_openai_clients().get(api_key).models.list()
         return True
     except openai.AuthenticationError:
+        get_openai_clients().discard(api_key)
         return False
 
 # Function to validate Google API key
 def validate_google_api_key(api_key, cse_id):
-    search_url = 'https://www.googleapis.com/customsearch/v1'
+    search_url = http_client.GOOGLE_SEARCH_URL
     params = {
         'q': 'test',
         'key': api_key,
         'cx': cse_id,
     }
-    response = requests.get(search_url, params=params)
-    return response.status_code == 200
+    try:
+        response = http_client.get(search_url, params=params)
+    except requests.RequestException:
+        # Couldn't reach Google, the key isn't known to be invalid
+        return None
+    if response.status_code == 200:
+        return True
+    # Rate limits and server errors don't say anything about the key either
+    if 400 <= response.status_code < 500 and response.status_code != 429:
+        return False
+    return None
 
 # Function to perform web search using Google Custom Search API
 def web_search(query, google_api_key, cse_id, excluded_domains=None):
-    search_url = 'https://www.googleapis.com/customsearch/v1'
+    search_url = http_client.GOOGLE_SEARCH_URL
     params = {
         'q': query,
         'key': google_api_key,
         'cx': cse_id,
     }
-    response = requests.get(search_url, params=params)
-    response.raise_for_status()
+    with get_metrics().timed('web_search') as event:
+        response = http_client.get(search_url, params=params)
+        event['payload_bytes'] = len(response.content)
+        response.raise_for_status()
     search_results = response.json()
 
     # Filter out results from excluded domains
@@ -44,8 +82,8 @@ def web_search(query, google_api_key, cse_id, excluded_domains=None):
     
     return search_results.get('items', [])
 
-# Function to generate response using OpenAI API
-def generate_response_with_sources(user_query, google_api_key, cse_id):
+# Function to generate a streamed response using OpenAI API, returned with its sources
+def generate_response_with_sources(client, user_query, google_api_key, cse_id):
     excluded_domains = ["reddit.com"]
     search_results = web_search(user_query, google_api_key, cse_id)
     sources = [result['link'] for result in search_results]
@@ -60,14 +98,17 @@ def generate_response_with_sources(user_query, google_api_key, cse_id):
         },
         {"role": "user", "content": f"User Query: {user_query}\n\nWeb Search Results:\n{context}\n\nAnswer:"}
     ]
-    response = openai.chat.completions.create(
+    # Low-temperature answers to the same query and results are reused from the completion cache
+    response_stream = get_metrics().completion(
+        'chat_completion',
+        functools.partial(get_completion_cache().create, client, max_temperature=0.2),
         model='gpt-4o-mini',  # Update to 'gpt-3.5-turbo' or another model you're using
         messages=messages,
         max_tokens=4000,
-        temperature=0.2
+        temperature=0.2,
+        stream=True
     )
-    answer = response.choices[0].message.content
-    return answer, sources
+    return response_stream, sources
 
 # Streamlit UI
 st.title('ChatGPT with Live Web Search')
@@ -79,16 +120,27 @@ cse_id = st.text_input('Enter your Google Custom Search Engine ID:')
 
 # Validate API keys
 if openai_api_key and google_api_key and cse_id:
-    if validate_openai_api_key(openai_api_key) and validate_google_api_key(google_api_key, cse_id):
+    key_validation_cache = get_key_validation_cache()
+    if (
+        key_validation_cache.validate(validate_openai_api_key, openai_api_key)
+        and key_validation_cache.validate(validate_google_api_key, google_api_key, cse_id)
+    ):
+        # This session's own client, never the process-wide openai.api_key
+        client = get_openai_clients().get(openai_api_key)
         st.success('API keys are valid. You can now use the application.')
         user_query = st.text_input('Ask a question:')
         if user_query:
-            answer, sources = generate_response_with_sources(user_query, google_api_key, cse_id)
+            turn_timer = TurnTimer()
+            response_stream, sources = generate_response_with_sources(client, user_query, google_api_key, cse_id)
             st.write('**Answer:**')
-            st.write(answer)
+            # The answer streams into this container while the sources are already shown below it
+            answer_container = st.container()
             st.write('**Sources:**')
-            for source in sources:
-                st.write(f'- {source}')
+            st.write('\n'.join(f'- {source}' for source in sources))
+            with answer_container:
+                st.write_stream(turn_timer.stream_text(response_stream))
+            st.caption(turn_timer.summary())
+        render_metrics_panel(get_metrics(), cache_stats={'Completion cache': get_completion_cache().stats()})
     else:
         st.error('Invalid API keys. Please check your keys and try again.')
 else:
@@ -1,10 +1,23 @@
+import functools
 import streamlit as st
 import openai
 import requests
-import json
-import os
+import http_client
+from chat_render import render_chat_history
+from chat_store import ChatStore
+from completion_cache import CompletionCache
+from context_window import build_messages, message_tokens, with_token_count
+from instrumentation import Metrics, render_metrics_panel
+from key_validation import KeyValidationCache
+from openai_clients import OpenAIClientRegistry
+from retrieval import OpenAIEmbedder, Retriever, build_context
+from search_cache import SearchCache
+from search_pipeline import search_turn
+from streaming import TurnTimer
 
 DB_FILE = 'db.json'
+DB_DIR = 'chat_db'
+SEARCH_CACHE_FILE = 'search_cache.sqlite3'
 
 DEFAULT_PROMPT = (
     "You are an investment analyst designed to assist users in evaluating potential investments. Your primary goal is to guide users through the investment evaluation process by providing insightful analysis and encouraging deeper exploration based on their responses. After providing an answer, always offer the user options for next action items (e.g., 'Would you like me to explore further details on...?') to facilitate a comprehensive understanding."
@@ -12,54 +25,101 @@ DEFAULT_PROMPT = (
     "Note: Do not mention any information cutoff dates, as you have access to live web search capabilities. Ensure that all information provided is accurate and up-to-date, and refrain from making up any information."
 )
 
+# Chat store shared across reruns and users, flushing appends in the background
+@st.cache_resource
+def get_chat_store():
+    return ChatStore(DB_DIR, legacy_db_file=DB_FILE, write_behind=True)
+
+# Search results cache shared across reruns, sessions and restarts
+@st.cache_resource
+def get_search_cache():
+    return SearchCache(persist_path=SEARCH_CACHE_FILE)
+
+# Deterministic completions cached on disk, replayed as a stream on a hit
+@st.cache_resource
+def get_completion_cache():
+    return CompletionCache()
+
+# Pooled OpenAI clients, one per API key, shared across reruns and sessions
+@st.cache_resource
+def get_openai_clients():
+    return OpenAIClientRegistry()
+
+# Call metrics shared across reruns and sessions, see instrumentation.Metrics.from_env
+@st.cache_resource
+def get_metrics():
+    return Metrics.from_env()
+
+# Fetched pages and their passage embeddings, cached on disk across reruns and sessions
+@st.cache_resource
+def get_retriever():
+    return Retriever()
+
+# Key validation results shared across reruns and sessions, keyed on salted key hashes
+@st.cache_resource
+def get_key_validation_cache():
+    return KeyValidationCache()
+
 # Sidebar key validation functions
 def validate_openai_api_key(api_key):
     try:
-        openai.api_key = api_key
-        openai.models.list()  # Simple call to validate the key
+        get_openai_clients().get(api_key).models.list()  # Simple call to validate the key
         return True
     except openai.AuthenticationError:
+        get_openai_clients().discard(api_key)
         return False
 
 def validate_google_api_key(api_key, cse_id):
+    # True or False on Google's answer, None when it couldn't be reached or was rate limited
     try:
-        response = requests.get(
-            'https://www.googleapis.com/customsearch/v1',
+        response = http_client.get(
+            http_client.GOOGLE_SEARCH_URL,
             params={'q': 'test', 'key': api_key, 'cx': cse_id}
         )
-        return response.status_code == 200
-    except Exception:
+    except requests.RequestException:
+        return None
+    if response.status_code == 200:
+        return True
+    if 400 <= response.status_code < 500 and response.status_code != 429:
         return False
+    return None
 
 # Live Web Search Function
-def live_web_search(query, google_api_key, cse_id, excluded_domains=None):
-    search_url = 'https://www.googleapis.com/customsearch/v1'
-    params = {
-        'q': query,
-        'key': google_api_key,
-        'cx': cse_id,
-    }
-    response = requests.get(search_url, params=params)
-    response.raise_for_status()
-    results = response.json()
+def live_web_search(query, google_api_key, cse_id, excluded_domains=None, start=1):
+    with get_metrics().timed("web_search", start=start) as event:
+        search_cache = get_search_cache()
+        cached_results = search_cache.get(query, cse_id, excluded_domains, start)
+        event["cache_hit"] = cached_results is not None
+        if cached_results is not None:
+            return cached_results
+
+        search_url = http_client.GOOGLE_SEARCH_URL
+        params = {
+            'q': query,
+            'key': google_api_key,
+            'cx': cse_id,
+        }
+        if start != 1:
+            params['start'] = start
+        response = http_client.get(search_url, params=params)
+        event["payload_bytes"] = len(response.content)
+        response.raise_for_status()
+        results = response.json()
     
-    # Filter results from excluded domains
-    if excluded_domains:
-        results['items'] = [
-            result for result in results.get('items', [])
-            if not any(domain in result['link'] for domain in excluded_domains)
-        ]
-    return results.get('items', [])
+        # Filter results from excluded domains
+        if excluded_domains:
+            results['items'] = [
+                result for result in results.get('items', [])
+                if not any(domain in result['link'] for domain in excluded_domains)
+            ]
+        event["results"] = len(results.get('items', []))
+        search_cache.set(query, cse_id, excluded_domains, results.get('items', []), start)
+        return results.get('items', [])
 
 # Main Function
 def main():
-    # Load or initialize database
-    if not os.path.exists(DB_FILE):
-        with open(DB_FILE, 'w') as file:
-            json.dump({'openai_api_keys': [], 'chat_sessions': {}}, file)
-
-    with open(DB_FILE, 'r') as file:
-        db = json.load(file)
+    # Chat store, importing an existing db.json on first run
+    store = get_chat_store()
 
     st.sidebar.title("Chat Settings")
     
@@ -70,7 +130,11 @@ def main():
     validate_keys = st.sidebar.button("Validate Keys")
 
     if validate_keys:
-        if validate_openai_api_key(openai_api_key) and validate_google_api_key(google_api_key, google_cse_id):
+        key_validation_cache = get_key_validation_cache()
+        if (
+            key_validation_cache.validate(validate_openai_api_key, openai_api_key)
+            and key_validation_cache.validate(validate_google_api_key, google_api_key, google_cse_id)
+        ):
             st.success("API Keys Validated!")
             st.session_state.openai_api_key = openai_api_key
             st.session_state.google_api_key = google_api_key
@@ -83,16 +147,15 @@ def main():
         st.warning("Please enter valid API keys to proceed.")
         return
 
-    openai.api_key = st.session_state.openai_api_key
+    # This session's own client, never the process-wide openai.api_key
+    client = get_openai_clients().get(st.session_state.openai_api_key)
 
     # Sidebar: Model Selection
     models = ["gpt-4o-mini", "gpt-4o", "gpt-3.5-turbo"]
     selected_model = st.sidebar.selectbox("Select OpenAI Model", models)
 
     # Multi-session management
-    if "chat_sessions" not in db:
-        db["chat_sessions"] = {}
-    session_names = list(db["chat_sessions"].keys())
+    session_names = store.session_names()
     selected_session = st.sidebar.selectbox(
         "Select Chat Session",
         session_names + ["New Chat"],
@@ -101,79 +164,104 @@ def main():
     if selected_session == "New Chat":
         new_session_name = st.sidebar.text_input("Enter a name for the new session")
         if st.sidebar.button("Create Session"):
-            if new_session_name:
-                db["chat_sessions"][new_session_name] = [{"role": "system", "content": DEFAULT_PROMPT}]
-                with open(DB_FILE, 'w') as file:
-                    json.dump(db, file)
+            if new_session_name in session_names:
+                st.sidebar.error("A session with this name already exists.")
+            elif new_session_name:
+                store.create_session(new_session_name, [{"role": "system", "content": DEFAULT_PROMPT}])
                 st.rerun()
             else:
                 st.sidebar.error("Session name cannot be empty.")
     elif st.sidebar.button("Clear Chat"):
-        db["chat_sessions"][selected_session] = [{"role": "system", "content": DEFAULT_PROMPT}]
-        with open(DB_FILE, 'w') as file:
-            json.dump(db, file)
+        store.reset_session(selected_session, [{"role": "system", "content": DEFAULT_PROMPT}])
         st.rerun()
 
     # Load chat history for selected session
-    chat_history = db["chat_sessions"].get(selected_session, [])
+    chat_history = store.load_session(selected_session) if selected_session in session_names else []
 
-    # Display chat messages
-    for message in chat_history:
-        if message["role"] != "system":
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
+    # Display the most recent chat messages, older ones are paged in on demand
+    render_chat_history(chat_history, key=selected_session)
 
     # Accept user input
     user_input = st.chat_input("Type your message:")
     if user_input:
+        turn_timer = TurnTimer()
         with st.chat_message("user"):
             st.markdown(user_input)
-        chat_history.append({"role": "user", "content": user_input})
+        chat_history.append(with_token_count({"role": "user", "content": user_input}))
         
-        # Perform live web search
-        search_results = live_web_search(
+        # Search both result pages concurrently while token counts for the history are prepared
+        search_results, _ = search_turn(
             user_input,
-            st.session_state.google_api_key,
-            st.session_state.google_cse_id,
-            excluded_domains=["reddit.com"]
+            lambda query, start: live_web_search(
+                query,
+                st.session_state.google_api_key,
+                st.session_state.google_cse_id,
+                excluded_domains=["reddit.com"],
+                start=start,
+            ),
+            prepare=lambda: [message_tokens(message) for message in chat_history],
         )
-        
-        if search_results:
-            snippets = [result["snippet"] for result in search_results]
-            sources = [result["link"] for result in search_results]
-            
-            # Prepare context for OpenAI response
-            search_context = "\n".join(snippets)
-            messages = chat_history + [
-                {"role": "system", "content": DEFAULT_PROMPT},
-                {"role": "user", "content": user_input},
-                {"role": "assistant", "content": f"Based on the following search results:\n{search_context}"}
-            ]
-            
-            # Generate OpenAI response
-            response = openai.chat.completions.create(
-                model=selected_model,
-                messages=messages,
-                max_tokens=4000,
-                temperature=0.2
-            )
-            response_content = response.choices[0].message.content
-        else:
-            response_content = "No search results found. Please refine your query or try again."
-            sources = []
 
-        # Display assistant response
         with st.chat_message("assistant"):
-            st.markdown(response_content)
-            if sources:
-                st.markdown("\n\n**Sources:**")
-                for source in sources:
-                    st.markdown(f"- [{source}]({source})")
-
-        chat_history.append({"role": "assistant", "content": response_content})
-        db["chat_sessions"][selected_session] = chat_history
-        with open(DB_FILE, 'w') as file:
-            json.dump(db, file)
+            # The answer streams into this container, above the sources shown right away
+            answer_container = st.container()
+            if search_results:
+                sources = [result["link"] for result in search_results]
+                st.markdown("**Sources:**\n" + "\n".join(f"- [{source}]({source})" for source in sources))
+
+                # The result pages' passages closest to the question, snippets if retrieval fails
+                try:
+                    with get_metrics().timed("retrieval", pages=len(search_results)) as event:
+                        passages = get_retriever().retrieve(user_input, search_results, OpenAIEmbedder(client))
+                        search_context, used_passages = build_context(passages)
+                        event["passages"] = len(used_passages)
+                except Exception:
+                    search_context = "\n".join(result["snippet"] for result in search_results)
+
+                # Prepare context for OpenAI response, bounded by the model's token budget
+                messages = build_messages(
+                    [{"role": "system", "content": DEFAULT_PROMPT}] + chat_history,
+                    selected_model,
+                    extra_messages=[
+                        {"role": "system", "content": f"Web search results for the latest question:\n{search_context}"}
+                    ],
+                )
+
+                # Stream the OpenAI response as it is generated
+                # Low-temperature answers to the same context are reused from the completion cache
+                response_stream = get_metrics().completion(
+                    "chat_completion",
+                    functools.partial(get_completion_cache().create, client, max_temperature=0.2),
+                    model=selected_model,
+                    messages=messages,
+                    max_tokens=4000,
+                    temperature=0.2,
+                    stream=True
+                )
+                with answer_container:
+                    response_content = st.write_stream(turn_timer.stream_text(response_stream))
+            else:
+                response_content = "No search results found. Please refine your query or try again."
+                sources = []
+                answer_container.markdown(response_content)
+            turn_timer.finish()
+            st.caption(turn_timer.summary())
+
+        chat_history.append(with_token_count(
+            {"role": "assistant", "content": response_content, "sources": sources, **turn_timer.as_dict()}
+        ))
+
+        # Append only this turn to the session log
+        if selected_session not in session_names:
+            store.create_session(selected_session)
+        for message in chat_history[-2:]:
+            store.append_message(selected_session, message)
+
+    render_metrics_panel(get_metrics(), cache_stats={
+        "Search cache": get_search_cache().stats(),
+        "Completion cache": get_completion_cache().stats(),
+        "Retrieval": get_retriever().stats(),
+    })
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import time
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from sqlite_cache import SQLiteCache
+
+COMPLETION_CACHE_FILE = 'completions.sqlite3'
+COMPLETION_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+COMPLETION_CACHE_MAX_ENTRIES = 5000
+DEFAULT_TEMPERATURE = 1.0  # what the API uses when temperature isn't passed
+REPLAY_CHUNK_CHARS = 40
+# Arguments that only change how a response is delivered, not what it says
+TRANSPORT_ARGS = ('stream', 'stream_options', 'timeout', 'extra_headers', 'extra_query', 'extra_body', 'user')
+
+
+def normalize_messages(messages):
+    """Role and content only, with surrounding whitespace removed from the content."""
+    normalized = []
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            content = content.strip()
+        normalized.append({'role': message['role'], 'content': content})
+    return normalized
+
+
+def completion_key(kwargs):
+    """Hash of the model, the normalized messages and every sampling parameter."""
+    request = {key: value for key, value in kwargs.items() if key not in TRANSPORT_ARGS}
+    request['messages'] = normalize_messages(request.get('messages', []))
+    payload = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_cached(response):
+    """Whether a response or stream chunk was replayed from the cache."""
+    return bool(getattr(response, 'cached', False))
+
+
+def _replay_stream(entry, chunk_chars=REPLAY_CHUNK_CHARS):
+    # Cached answers come back as real chunk objects, so st.write_stream and
+    # TurnTimer.stream_text handle them exactly like a live stream. The extra
+    # `cached` field marks them for is_cached
+    content = entry['content']
+    pieces = [content[i:i + chunk_chars] for i in range(0, len(content), chunk_chars)] or ['']
+    for index, piece in enumerate(pieces):
+        delta = {'content': piece}
+        if index == 0:
+            delta['role'] = 'assistant'
+        yield ChatCompletionChunk.model_validate({
+            'id': entry['id'],
+            'object': 'chat.completion.chunk',
+            'created': entry['created'],
+            'model': entry['model'],
+            'choices': [{
+                'index': 0,
+                'delta': delta,
+                'finish_reason': entry['finish_reason'] if index == len(pieces) - 1 else None,
+            }],
+            'cached': True,
+        })
+    if entry.get('usage'):
+        # Like a live stream asked for usage, the last chunk has no choices
+        yield ChatCompletionChunk.model_validate({
+            'id': entry['id'],
+            'object': 'chat.completion.chunk',
+            'created': entry['created'],
+            'model': entry['model'],
+            'choices': [],
+            'usage': entry['usage'],
+            'cached': True,
+        })
+
+
+def _cached_completion(entry):
+    return ChatCompletion.model_validate({
+        'id': entry['id'],
+        'object': 'chat.completion',
+        'created': entry['created'],
+        'model': entry['model'],
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': entry['content']},
+            'finish_reason': entry['finish_reason'],
+        }],
+        'usage': entry.get('usage'),
+        'cached': True,
+    })
+
+
+class CompletionCache:
+    """
+    Persistent cache of chat completions for deterministic requests, keyed on
+    the model, the normalized messages and the sampling parameters. Requests
+    sampled above max_temperature (the API default of 1 when temperature
+    isn't passed) or asking for several choices always go to the API.
+    Streaming requests are recorded as they are consumed and replayed as a
+    stream of chunks on a hit.
+    """
+
+    def __init__(self, path=COMPLETION_CACHE_FILE, ttl=COMPLETION_CACHE_TTL,
+                 max_entries=COMPLETION_CACHE_MAX_ENTRIES, max_temperature=0.0):
+        self._store = SQLiteCache(path, table='completions', ttl=ttl, max_entries=max_entries)
+        self.max_temperature = max_temperature
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, kwargs, max_temperature=None):
+        max_temperature = self.max_temperature if max_temperature is None else max_temperature
+        temperature = kwargs.get('temperature')
+        temperature = DEFAULT_TEMPERATURE if temperature is None else temperature
+        return temperature <= max_temperature and kwargs.get('n', 1) == 1
+
+    def create(self, client, max_temperature=None, **kwargs):
+        """
+        Drop-in for client.chat.completions.create(**kwargs). client is an
+        OpenAI client or the openai module itself. max_temperature overrides
+        the cache's threshold for this call, for callers that accept reusing
+        an answer sampled at a low temperature.
+        """
+        if not self.cacheable(kwargs, max_temperature):
+            return client.chat.completions.create(**kwargs)
+
+        key = completion_key(kwargs)
+        entry = self._store.get(key)
+        if entry is not None:
+            self.hits += 1
+            return _replay_stream(entry) if kwargs.get('stream') else _cached_completion(entry)
+
+        self.misses += 1
+        response = client.chat.completions.create(**kwargs)
+        if kwargs.get('stream'):
+            return self._record_stream(key, response)
+        choice = response.choices[0]
+        self._store.set(key, {
+            'id': response.id,
+            'created': response.created,
+            'model': response.model,
+            'content': choice.message.content or '',
+            'finish_reason': choice.finish_reason,
+            'usage': response.usage.model_dump() if response.usage else None,
+        })
+        return response
+
+    def _record_stream(self, key, stream):
+        parts = []
+        entry = None
+        usage = None
+        for chunk in stream:
+            if getattr(chunk, 'usage', None) is not None:
+                usage = chunk.usage.model_dump()
+            if chunk.choices:
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                if choice.finish_reason:
+                    entry = {
+                        'id': chunk.id,
+                        'created': chunk.created or int(time.time()),
+                        'model': chunk.model,
+                        'finish_reason': choice.finish_reason,
+                    }
+            yield chunk
+        # Only complete answers are stored, not streams cut short by an error
+        if entry is not None:
+            entry['content'] = ''.join(parts)
+            entry['usage'] = usage
+            self._store.set(key, entry)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._store)}
@@ -0,0 +1,99 @@
+try:
+    import tiktoken
+except ImportError:  # fall back to a characters-per-token estimate
+    tiktoken = None
+
+# Prompt tokens we allow per request, leaving room for the completion
+MODEL_CONTEXT_BUDGETS = {
+    "gpt-4o-mini": 16000,
+    "gpt-4o": 16000,
+    "gpt-4-turbo": 16000,
+    "gpt-4": 4000,
+    "gpt-3.5-turbo": 8000,
+}
+DEFAULT_CONTEXT_BUDGET = 4000
+MESSAGE_OVERHEAD = 4  # role and separator tokens per chat message
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+
+
+def count_tokens(text):
+    global _encoding
+    if tiktoken is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message):
+    """
+    Token count of a chat message. The count is stored on the message under
+    "tokens" so it is saved with the history and never recomputed.
+    """
+    if "tokens" not in message:
+        message["tokens"] = count_tokens(message["content"]) + MESSAGE_OVERHEAD
+    return message["tokens"]
+
+
+def with_token_count(message):
+    message_tokens(message)
+    return message
+
+
+def context_budget(model):
+    return MODEL_CONTEXT_BUDGETS.get(model, DEFAULT_CONTEXT_BUDGET)
+
+
+def build_messages(history, model, extra_messages=(), budget=None, summarize=None):
+    """
+    Assemble the messages for a chat completion from the stored history.
+
+    System prompts are deduplicated and always kept, extra_messages (e.g.
+    search results for the current turn) are appended after the history, and
+    the most recent turns are kept inside the model's token budget. Older
+    turns are passed to summarize(dropped_messages) -> str when given,
+    otherwise they are dropped with a short note. The newest turn is always
+    sent. Returned messages only carry role and content.
+    """
+    if budget is None:
+        budget = context_budget(model)
+
+    system_messages = []
+    seen_prompts = set()
+    turns = []
+    for message in history:
+        if message["role"] == "system":
+            if message["content"] not in seen_prompts:
+                seen_prompts.add(message["content"])
+                system_messages.append(message)
+        else:
+            turns.append(message)
+
+    remaining = budget
+    remaining -= sum(message_tokens(m) for m in system_messages)
+    remaining -= sum(message_tokens(m) for m in extra_messages)
+
+    # Walk back from the newest turn until the budget runs out
+    kept = []
+    for message in reversed(turns):
+        tokens = message_tokens(message)
+        if kept and tokens > remaining:
+            break
+        kept.append(message)
+        remaining -= tokens
+    kept.reverse()
+
+    dropped = turns[:len(turns) - len(kept)]
+    if dropped:
+        if summarize is not None:
+            note = f"Summary of the earlier conversation:\n{summarize(dropped)}"
+        else:
+            note = f"{len(dropped)} earlier messages were omitted to fit the context window."
+        system_messages = system_messages + [{"role": "system", "content": note}]
+
+    return [
+        {"role": m["role"], "content": m["content"]}
+        for m in system_messages + kept + list(extra_messages)
+    ]
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from pandas.api.types import union_categoricals
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PREVIEW_ROWS = 1000
+CHUNK_ROWS = 100_000
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+CATEGORY_MAX_UNIQUE = 10_000
+FINGERPRINT_SAMPLE_ROWS = 1000
+
+
+def file_kind(file):
+    name = file.name.lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.xls', '.xlsx')):
+        return 'excel'
+    return None
+
+
+def read_preview(file, nrows=PREVIEW_ROWS, usecols=None):
+    """Read only the first nrows of an upload, whatever the file size."""
+    file.seek(0)
+    if file_kind(file) == 'csv':
+        preview = pd.read_csv(file, nrows=nrows, usecols=usecols)
+    else:
+        preview = pd.read_excel(file, nrows=nrows, usecols=usecols)
+    file.seek(0)
+    return preview
+
+
+def infer_category_columns(sample):
+    # Low-cardinality string columns are stored as categoricals
+    category_columns = []
+    for column in sample.select_dtypes(include=['object', 'string']).columns:
+        values = sample[column].dropna()
+        if values.empty:
+            continue
+        unique = values.nunique()
+        if unique <= CATEGORY_MAX_UNIQUE and unique / len(values) <= CATEGORY_MAX_UNIQUE_RATIO:
+            category_columns.append(column)
+    return category_columns
+
+
+def downcast(df):
+    """Shrink numeric columns to the smallest dtype that holds their values."""
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_integer_dtype(series.dtype):
+            df[column] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series.dtype) and series.dtype != np.float32:
+            # Floats are only narrowed when no precision is lost
+            narrowed = series.astype(np.float32)
+            if np.array_equal(narrowed.to_numpy(np.float64), series.to_numpy(), equal_nan=True):
+                df[column] = narrowed
+    return df
+
+
+def _concat_chunks(chunks, category_columns):
+    if len(chunks) == 1:
+        return chunks[0]
+    # Each chunk has its own categories, union them instead of falling back to object
+    categoricals = {
+        column: union_categoricals([chunk[column] for chunk in chunks], ignore_order=True)
+        for column in category_columns
+    }
+    df = pd.concat(
+        [chunk.drop(columns=list(categoricals)) for chunk in chunks],
+        ignore_index=True,
+    )
+    for column, values in categoricals.items():
+        df[column] = values
+    return df[chunks[0].columns]
+
+
+def _max_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_dataframe(file, columns=None, chunksize=CHUNK_ROWS):
+    """
+    Load an uploaded CSV or Excel file, reading only `columns` (all when None).
+
+    The schema is inferred from a sample first: low-cardinality string
+    columns become categoricals and numeric columns are downcast. CSVs are
+    streamed in chunks, so only one raw chunk is held at a time. Returns the
+    DataFrame and a dict of load statistics, including the peak memory used
+    by the loaded data.
+    """
+    started_at = time.perf_counter()
+    sample = read_preview(file, usecols=columns)
+    category_columns = infer_category_columns(sample)
+    dtypes = {column: 'category' for column in category_columns}
+
+    file.seek(0)
+    if file_kind(file) == 'csv':
+        chunks = []
+        loaded_bytes = 0
+        peak_bytes = 0
+        for chunk in pd.read_csv(file, usecols=columns, dtype=dtypes, chunksize=chunksize):
+            chunk_bytes = chunk.memory_usage(deep=True).sum()
+            peak_bytes = max(peak_bytes, loaded_bytes + chunk_bytes)
+            chunk = downcast(chunk)
+            loaded_bytes += chunk.memory_usage(deep=True).sum()
+            chunks.append(chunk)
+        if chunks:
+            df = _concat_chunks(chunks, category_columns)
+            if len(chunks) > 1:
+                # The chunks and the concatenated frame briefly coexist
+                peak_bytes = max(peak_bytes, loaded_bytes + df.memory_usage(deep=True).sum())
+        else:
+            df = sample.iloc[0:0]
+    else:
+        # Excel can't be streamed by pandas, but unused columns are still skipped
+        df = pd.read_excel(file, usecols=columns, dtype=dtypes)
+        peak_bytes = df.memory_usage(deep=True).sum()
+        df = downcast(df)
+    file.seek(0)
+    if columns is not None:
+        # usecols keeps the file's column order, give them back in the order asked for
+        df = df[list(columns)]
+
+    memory_bytes = int(df.memory_usage(deep=True).sum())
+    stats = {
+        "Rows": len(df),
+        "Columns": len(df.columns),
+        "Memory (bytes)": memory_bytes,
+        "Peak memory (bytes)": int(max(peak_bytes, memory_bytes)),
+        "Process max RSS (bytes)": _max_rss_bytes(),
+        "Load time (s)": round(time.perf_counter() - started_at, 3),
+    }
+    return df, stats
+
+
+def load_arrow_table(file, columns=None):
+    """
+    Load an uploaded file straight into an Arrow table, reading only
+    `columns` (all when None).
+
+    CSVs are parsed by Arrow, so no pandas copy of the data is ever held;
+    low-cardinality string columns are dictionary encoded, as load_dataframe
+    makes them categoricals. Excel goes through load_dataframe and the frame
+    is dropped once converted. Returns the table and a dict of load
+    statistics.
+    """
+    started_at = time.perf_counter()
+    if file_kind(file) == 'csv':
+        sample = read_preview(file, usecols=columns)
+        dictionary = pa.dictionary(pa.int32(), pa.string())
+        convert_options = pa_csv.ConvertOptions(
+            include_columns=list(columns) if columns is not None else None,
+            column_types={column: dictionary for column in infer_category_columns(sample)},
+        )
+        file.seek(0)
+        table = pa_csv.read_csv(file, convert_options=convert_options)
+        file.seek(0)
+    else:
+        df, _ = load_dataframe(file, columns=columns)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        del df
+    stats = {
+        "Rows": table.num_rows,
+        "Columns": table.num_columns,
+        "Memory (bytes)": table.nbytes,
+        "Process max RSS (bytes)": _max_rss_bytes(),
+        "Load time (s)": round(time.perf_counter() - started_at, 3),
+    }
+    return table, stats
+
+
+def dataframe_fingerprint(df, sample_rows=FINGERPRINT_SAMPLE_ROWS):
+    """
+    Fast content fingerprint of a DataFrame: a hash of its schema and shape
+    plus a hash of up to sample_rows rows spread evenly through the frame.
+    """
+    digest = hashlib.sha256()
+    schema = [list(map(str, df.columns)), list(map(str, df.dtypes)), list(df.shape)]
+    digest.update(json.dumps(schema).encode('utf-8'))
+    if len(df):
+        positions = np.unique(np.linspace(0, len(df) - 1, min(len(df), sample_rows)).astype(int))
+        sample = df.iloc[positions]
+        try:
+            row_hashes = pd.util.hash_pandas_object(sample, index=True).to_numpy()
+            digest.update(row_hashes.tobytes())
+        except TypeError:
+            # Unhashable cells such as lists, fall back to their text form
+            digest.update(sample.to_csv().encode('utf-8'))
+    return digest.hexdigest()
@@ -0,0 +1,107 @@
+import math
+import threading
+from collections import OrderedDict
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import streamlit as st
+
+PAGE_SIZE = 100
+MAX_VIEWS = 8
+
+
+class TablePreview:
+    """
+    A large table kept on the server as Arrow, read one page at a time.
+    Unsorted pages are zero-copy slices; sorted pages take rows through sort
+    indices computed once per column and direction. Column selections are
+    views over the same buffers and share the sort indices; the most recently
+    used max_views of them are kept.
+    """
+
+    def __init__(self, table, sort_cache=None, lock=None, max_views=MAX_VIEWS):
+        self.table = table
+        # Shared with the views of this table, keyed on (column, descending)
+        self._sort_indices = {} if sort_cache is None else sort_cache
+        self._lock = lock or threading.Lock()
+        self._views = OrderedDict()
+        self.max_views = max_views
+
+    @property
+    def num_rows(self):
+        return self.table.num_rows
+
+    @property
+    def column_names(self):
+        return self.table.column_names
+
+    def select(self, columns):
+        """A view of some columns, without copying them."""
+        columns = tuple(columns)
+        with self._lock:
+            view = self._views.get(columns)
+            if view is None:
+                view = self._views[columns] = TablePreview(
+                    self.table.select(list(columns)), self._sort_indices, self._lock, self.max_views
+                )
+                while len(self._views) > self.max_views:
+                    self._views.popitem(last=False)
+            else:
+                self._views.move_to_end(columns)
+        return view
+
+    def sort_indices(self, column, descending=False):
+        key = (column, descending)
+        with self._lock:
+            indices = self._sort_indices.get(key)
+        if indices is None:
+            order = 'descending' if descending else 'ascending'
+            values = self.table.column(column)
+            if pa.types.is_dictionary(values.type):
+                # Dictionary (categorical) columns can't be sorted directly, sort their values
+                values = values.cast(values.type.value_type)
+            indices = pc.array_sort_indices(values, order=order)
+            with self._lock:
+                self._sort_indices[key] = indices
+        return indices
+
+    def num_pages(self, page_size=PAGE_SIZE):
+        return max(math.ceil(self.num_rows / page_size), 1)
+
+    def page(self, page, page_size=PAGE_SIZE, sort_by=None, descending=False):
+        """
+        Rows of one page (0-based) as a DataFrame indexed by their row number
+        in the full table. Only the page is ever converted to pandas.
+        """
+        start = min(page * page_size, self.num_rows)
+        if sort_by is None:
+            rows = self.table.slice(start, page_size)
+            positions = range(start, start + rows.num_rows)
+        else:
+            indices = self.sort_indices(sort_by, descending).slice(start, page_size)
+            rows = self.table.take(indices)
+            positions = indices.to_pylist()
+        frame = rows.to_pandas()
+        frame.index = positions
+        return frame
+
+    def to_pandas(self):
+        return self.table.to_pandas()
+
+
+def render_table_preview(preview, key, page_size=PAGE_SIZE):
+    """Page and sort controls over a TablePreview; only the visible page is sent to the browser."""
+    sort_column, order_column, page_column = st.columns([3, 2, 2])
+    sort_by = sort_column.selectbox(
+        "Sort by", [None] + preview.column_names,
+        format_func=lambda column: "(file order)" if column is None else column,
+        key=f"{key}_sort",
+    )
+    descending = order_column.toggle("Descending", key=f"{key}_descending", disabled=sort_by is None)
+    pages = preview.num_pages(page_size)
+    page = page_column.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, value=1, key=f"{key}_page")
+
+    frame = preview.page(page - 1, page_size, sort_by, descending)
+    st.dataframe(frame)
+    first_row = (page - 1) * page_size
+    st.caption(f"Rows {min(first_row + 1, preview.num_rows):,}–{first_row + len(frame):,} of {preview.num_rows:,}.")
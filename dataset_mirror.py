@@ -0,0 +1,101 @@
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import http_client
+
+MIRROR_DIR = '.datasets'
+DOWNLOAD_CHUNK_BYTES = 1024 ** 2
+
+
+def _local_path(source):
+    # Plain paths and file:// URLs both stand in for a remote dataset
+    parsed = urlparse(source)
+    if parsed.scheme == 'file':
+        return url2pathname(parsed.path)
+    if parsed.scheme in ('http', 'https'):
+        return None
+    return source
+
+
+class DatasetMirror:
+    """
+    A remote CSV mirrored once into a local, uncompressed Feather (Arrow IPC)
+    file with typed columns. The first load downloads and parses the CSV
+    with read_options and explicit datetime formats; every later load
+    memory-maps the mirror, so taking the first nrows rows reads only those
+    rows and never re-parses anything. The mirror file is named after a
+    hash of the source and parse options, so changing either builds a new
+    one. `source` can be a local path or file:// URL instead of an http(s)
+    URL, e.g. for tests.
+    """
+
+    def __init__(self, source, name, read_options=None, datetime_formats=None, lowercase_columns=False,
+                 root=MIRROR_DIR):
+        self.source = source
+        self.name = name
+        self.read_options = read_options or {}
+        self.datetime_formats = datetime_formats or {}
+        self.lowercase_columns = lowercase_columns
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def path(self):
+        settings = repr((self.source, self.read_options, self.datetime_formats, self.lowercase_columns))
+        digest = hashlib.sha256(settings.encode()).hexdigest()[:16]
+        return os.path.join(self.root, f"{self.name}-{digest}.feather")
+
+    def _download(self, directory):
+        # Streamed to disk in chunks, the compressed CSV is never held in memory whole
+        file_name = os.path.basename(urlparse(self.source).path) or 'download'
+        path = os.path.join(directory, file_name)
+        response = http_client.get(self.source, stream=True)
+        response.raise_for_status()
+        with response, open(path, 'wb') as file:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                file.write(chunk)
+        return path
+
+    def _parse(self, csv_path):
+        data = pd.read_csv(csv_path, **self.read_options)
+        if self.lowercase_columns:
+            data.columns = data.columns.str.lower()
+        for column, date_format in self.datetime_formats.items():
+            data[column] = pd.to_datetime(data[column], format=date_format)
+        return data
+
+    def refresh(self):
+        """Fetch and parse the source again, replacing the mirror."""
+        with tempfile.TemporaryDirectory(dir=self.root) as directory:
+            csv_path = _local_path(self.source) or self._download(directory)
+            table = pa.Table.from_pandas(self._parse(csv_path), preserve_index=False)
+            tmp_path = os.path.join(directory, 'mirror.feather')
+            # Uncompressed, so loads can map the columns without decoding them
+            feather.write_feather(table, tmp_path, compression='uncompressed')
+            os.replace(tmp_path, self.path)
+        # Mirrors of an earlier source or earlier options are not read again
+        for path in glob.glob(os.path.join(glob.escape(self.root), f"{glob.escape(self.name)}-*.feather")):
+            if path != self.path:
+                os.remove(path)
+
+    def table(self, nrows=None):
+        """The mirrored table, memory-mapped; the first nrows rows when given."""
+        if not os.path.exists(self.path):
+            with self._lock:
+                if not os.path.exists(self.path):
+                    self.refresh()
+        table = feather.read_table(self.path, memory_map=True)
+        return table if nrows is None else table.slice(0, nrows)
+
+    def load(self, nrows=None):
+        return self.table(nrows).to_pandas()
@@ -0,0 +1,121 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+MAX_WORKERS = 8
+QUESTION_TIMEOUT = 120  # seconds
+POLL_INTERVAL = 0.5
+
+
+def _start(questions, ask, max_workers):
+    # Submit every question at once; returns the executor, future -> question and start times
+    script_ctx = get_script_run_ctx()
+    started_at = {}
+
+    def timed_ask(question):
+        started_at[question] = time.monotonic()
+        return ask(question)
+
+    # One worker per question, so they all run in a single round
+    executor = ThreadPoolExecutor(
+        max_workers=max(min(max_workers, len(questions)), 1),
+        # Workers need the script context to use st.cache_* helpers
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), script_ctx),
+    )
+    pending = {executor.submit(timed_ask, question): question for question in questions}
+    return executor, pending, started_at
+
+
+def _finished(pending, started_at, timeout, wait_for):
+    # (question, answer) of the questions done or timed out within wait_for seconds, removed from pending
+    finished = []
+    done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+    for future in done:
+        question = pending.pop(future)
+        try:
+            finished.append((question, future.result()))
+        except Exception as error:
+            finished.append((question, error))
+    now = time.monotonic()
+    for future, question in list(pending.items()):
+        if question in started_at and now - started_at[question] > timeout:
+            # The thread can't be stopped, but its answer is no longer awaited
+            del pending[future]
+            finished.append((question, TimeoutError(f"No answer after {timeout} seconds.")))
+    return finished
+
+
+def run_questions(questions, ask, max_workers=MAX_WORKERS, timeout=QUESTION_TIMEOUT):
+    """
+    Start ask(question) for independent questions on a thread pool sized
+    to the questions (at most max_workers), and return an iterator of
+    (question, answer) as each one finishes. The questions are running
+    before the iterator is read. A question still running timeout seconds
+    after it started yields a TimeoutError, and one that raised yields its
+    exception, so a slow or failing question never holds up the others.
+    """
+    questions = list(questions)
+    if not questions:
+        return iter(())
+    return _collect(*_start(questions, ask, max_workers), timeout)
+
+
+def _collect(executor, pending, started_at, timeout):
+    try:
+        while pending:
+            yield from _finished(pending, started_at, timeout, POLL_INTERVAL)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def question_slots(questions, labels=None):
+    """
+    Reserve a placeholder per question, in page order, before any answer
+    arrives. labels optionally replaces the question in the progress caption,
+    e.g. for long prompts carrying computed results.
+    """
+    slots = {}
+    for position, question in enumerate(questions):
+        label = labels[position] if labels else question
+        slots[question] = st.empty()
+        slots[question].caption(f"Working on: {label}")
+    return slots
+
+
+def _show_answer(slot, answer):
+    if isinstance(answer, Exception):
+        slot.warning(f"Couldn't get an answer: {answer}")
+    else:
+        slot.write(answer)
+
+
+def fill_slots(slots, ask, serial=(), max_workers=MAX_WORKERS, timeout=QUESTION_TIMEOUT):
+    """
+    Answer every slot's question, rendering each answer as soon as it
+    completes. Questions run concurrently, except those in serial (e.g.
+    ones sharing a stateful, non-thread-safe agent), which are answered one
+    at a time in the calling thread while the others run; answers finished
+    meanwhile are rendered between them.
+    """
+    executor, pending, started_at = _start(
+        [question for question in slots if question not in serial], ask, max_workers
+    )
+    try:
+        for question in slots:
+            if question not in serial:
+                continue
+            for finished, answer in _finished(pending, started_at, timeout, 0):
+                _show_answer(slots[finished], answer)
+            try:
+                answer = ask(question)
+            except Exception as error:
+                answer = error
+            _show_answer(slots[question], answer)
+        while pending:
+            for finished, answer in _finished(pending, started_at, timeout, POLL_INTERVAL):
+                _show_answer(slots[finished], answer)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+EXPORT_DIR = '.exports'
+EXPORT_MAX_BYTES = 1024 ** 3
+CHUNK_ROWS = 50_000
+
+# format -> (label, file extension, MIME type)
+EXPORT_FORMATS = {
+    'csv': ('CSV', 'csv', 'text/csv'),
+    'csv.gz': ('compressed CSV', 'csv.gz', 'application/gzip'),
+    'parquet': ('Parquet', 'parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def _write_csv(df, path):
+    # to_csv formats and writes chunksize rows at a time, never the whole file as one string
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        df.to_csv(file, index=False, chunksize=CHUNK_ROWS)
+
+
+def _write_csv_gz(df, path):
+    with gzip.open(path, 'wt', newline='', encoding='utf-8', compresslevel=6) as file:
+        df.to_csv(file, index=False, chunksize=CHUNK_ROWS)
+
+
+def _write_parquet(df, path):
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # e.g. object columns mixing numbers and text, export those as text
+        df = df.astype({column: str for column in df.select_dtypes(include='object').columns})
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(table, path, row_group_size=CHUNK_ROWS)
+
+
+WRITERS = {'csv': _write_csv, 'csv.gz': _write_csv_gz, 'parquet': _write_parquet}
+
+
+class Exporter:
+    """
+    Download files built only when asked for, then cached on disk by the
+    content key of their source (e.g. the uploaded file's digest and sheet
+    name) and format. Files are written in chunks straight to disk and
+    evicted least recently used first past max_bytes.
+    """
+
+    def __init__(self, root=EXPORT_DIR, max_bytes=EXPORT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key, fmt):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, f"{digest}.{EXPORT_FORMATS[fmt][1]}")
+
+    def export(self, df, key, fmt):
+        """Path of the export of df in fmt, writing it first unless it is cached."""
+        path = self.path(key, fmt)
+        if os.path.exists(path):
+            # The mtime doubles as the last access time for eviction
+            os.utime(path)
+            return path
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            WRITERS[fmt](df, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(keep=path)
+        return path
+
+    def read(self, df, key, fmt):
+        with open(self.export(df, key, fmt), 'rb') as file:
+            return file.read()
+
+    def evict(self, keep=None):
+        with self._lock:
+            exports = []
+            total_bytes = 0
+            for entry in os.scandir(self.root):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    exports.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_bytes += stat.st_size
+            for _, size, path in sorted(exports):
+                if total_bytes <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+
+
+def export_button(exporter, df, key, file_stem, fmt='csv'):
+    """
+    A download button whose file is only built when clicked: Streamlit runs
+    the data callable on demand, so reruns never serialize df.
+    """
+    label, extension, mime = EXPORT_FORMATS[fmt]
+    return st.download_button(
+        label=f"Download as {label}",
+        data=lambda: exporter.read(df, key, fmt),
+        file_name=f"{file_stem}.{extension}",
+        mime=mime,
+        key=f"export_{fmt}_{key}",
+    )
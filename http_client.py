@@ -0,0 +1,99 @@
+import os
+import random
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Overridable so tests can point the apps at a local stub server
+GOOGLE_SEARCH_URL = os.environ.get('GOOGLE_SEARCH_URL', 'https://www.googleapis.com/customsearch/v1')
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+RETRY_STATUSES = {500, 502, 503, 504}
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 32
+
+_session = None
+_page_session = None
+_session_lock = threading.Lock()
+
+
+def _new_session(cookies=True):
+    session = requests.Session()
+    if not cookies:
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    # Retries are handled in get() so they can use jittered backoff
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """
+    Process-wide requests session with pooled keep-alive connections. The
+    underlying urllib3 pools are thread-safe, so one session is shared by
+    every script run.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _new_session()
+    return _session
+
+
+def get_page_session():
+    """
+    Process-wide session for arbitrary third-party pages. It never stores
+    cookies, so what one site sets is not sent on any later request.
+    """
+    global _page_session
+    if _page_session is None:
+        with _session_lock:
+            if _page_session is None:
+                _page_session = _new_session(cookies=False)
+    return _page_session
+
+
+def backoff_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass  # an HTTP date, fall back to our own schedule
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def get(url, params=None, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), retries=MAX_RETRIES, session=None, **kwargs):
+    """
+    GET through the shared session (or `session`) with explicit
+    connect/read timeouts. Connection errors, timeouts and 5xx responses
+    are retried up to `retries` times, and so are 429s that carry a
+    Retry-After. A 429 without one (e.g. Google's daily quota) would only
+    fail again, so it is returned at once. The last response (or exception)
+    is returned as-is.
+    """
+    session = session or get_session()
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, params=params, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        retry_after = response.headers.get('Retry-After')
+        retryable = response.status_code in RETRY_STATUSES or (response.status_code == 429 and retry_after)
+        if retryable and attempt < retries:
+            response.close()
+            time.sleep(backoff_delay(attempt, retry_after))
+            continue
+        return response
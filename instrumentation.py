@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import streamlit as st
+
+from completion_cache import is_cached
+
+logger = logging.getLogger('metrics')
+
+RECENT_CALLS = 1000
+METRICS_LOG_ENV = 'METRICS_LOG'
+METRICS_PORT_ENV = 'METRICS_PORT'
+METRICS_HOST_ENV = 'METRICS_HOST'
+DEFAULT_METRICS_HOST = '127.0.0.1'
+
+# The process's one Prometheus endpoint and the Metrics it currently serves
+_server = None
+_served_metrics = None
+_server_lock = threading.Lock()
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def _usage_fields(usage):
+    if usage is None:
+        return {}
+    return {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens}
+
+
+def payload_bytes(messages):
+    """Size of the messages as they are sent in the request body."""
+    return len(json.dumps(messages, default=str).encode('utf-8'))
+
+
+class Metrics:
+    """
+    Process-wide call metrics: every instrumented call is logged as one JSON
+    line and folded into counters (calls, errors, wall time, time to first
+    token, tokens, payload bytes, cache hits) per call name. The counters are
+    exposed as Prometheus text and summarized for the in-app panel.
+    """
+
+    def __init__(self, log_path=None, recent=RECENT_CALLS):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._wall_times = defaultdict(lambda: deque(maxlen=recent))
+        self._ttfts = defaultdict(lambda: deque(maxlen=recent))
+
+    @classmethod
+    def from_env(cls):
+        """
+        Metrics writing JSON lines to $METRICS_LOG, served on $METRICS_PORT
+        (bound to $METRICS_HOST, 127.0.0.1 by default) when set.
+        """
+        metrics = cls(log_path=os.environ.get(METRICS_LOG_ENV))
+        if os.environ.get(METRICS_PORT_ENV):
+            serve_prometheus(
+                metrics, int(os.environ[METRICS_PORT_ENV]), os.environ.get(METRICS_HOST_ENV, DEFAULT_METRICS_HOST)
+            )
+        return metrics
+
+    def record(self, name, **fields):
+        event = {'call': name, 'ts': round(time.time(), 3), **fields}
+        line = json.dumps(event, default=str)
+        with self._lock:
+            counters = self._counters
+            counters[(name, 'calls')] += 1
+            if fields.get('error'):
+                counters[(name, 'errors')] += 1
+            if fields.get('cache_hit'):
+                counters[(name, 'cache_hits')] += 1
+            for field in ('wall_time', 'ttft', 'prompt_tokens', 'completion_tokens', 'payload_bytes'):
+                if fields.get(field) is not None:
+                    counters[(name, field)] += fields[field]
+            if fields.get('wall_time') is not None:
+                self._wall_times[name].append(fields['wall_time'])
+            if fields.get('ttft') is not None:
+                counters[(name, 'ttft_count')] += 1
+                self._ttfts[name].append(fields['ttft'])
+            if self.log_path:
+                with open(self.log_path, 'a') as file:
+                    file.write(line + '\n')
+        logger.info(line)
+
+    @contextmanager
+    def timed(self, name, **fields):
+        """
+        Time the block and record it under name. The block can add fields
+        (cache_hit, tokens, payload bytes...) to the yielded dict.
+        """
+        event = dict(fields)
+        started_at = time.perf_counter()
+        try:
+            yield event
+        except Exception as e:
+            event['error'] = type(e).__name__
+            raise
+        finally:
+            event['wall_time'] = round(time.perf_counter() - started_at, 4)
+            self.record(name, **event)
+
+    def completion(self, name, create, **kwargs):
+        """
+        Call create(**kwargs), a chat.completions.create or CompletionCache.create
+        bound to a client, and record it. Streams are recorded once consumed,
+        with their time to first token and the usage of their final chunk.
+        """
+        fields = {'model': kwargs.get('model'), 'payload_bytes': payload_bytes(kwargs.get('messages', []))}
+        if not kwargs.get('stream'):
+            with self.timed(name, **fields) as event:
+                response = create(**kwargs)
+                event['cache_hit'] = is_cached(response)
+                event.update(_usage_fields(response.usage))
+            return response
+        # Ask for a final chunk carrying the token usage
+        kwargs.setdefault('stream_options', {'include_usage': True})
+        started_at = time.perf_counter()
+        try:
+            stream = create(**kwargs)
+        except Exception as e:
+            self.record(name, **fields, error=type(e).__name__,
+                        wall_time=round(time.perf_counter() - started_at, 4))
+            raise
+        return self._timed_stream(name, stream, started_at, fields)
+
+    def _timed_stream(self, name, stream, started_at, fields):
+        event = dict(fields)
+        try:
+            for chunk in stream:
+                if 'cache_hit' not in event:
+                    event['cache_hit'] = is_cached(chunk)
+                if 'ttft' not in event and chunk.choices and chunk.choices[0].delta.content:
+                    event['ttft'] = round(time.perf_counter() - started_at, 4)
+                if getattr(chunk, 'usage', None) is not None:
+                    event.update(_usage_fields(chunk.usage))
+                yield chunk
+        except Exception as e:
+            event['error'] = type(e).__name__
+            raise
+        finally:
+            # Also runs when the consumer stops early and the generator is closed
+            event['wall_time'] = round(time.perf_counter() - started_at, 4)
+            self.record(name, **event)
+
+    def summary(self):
+        """Per call name: calls, errors, cache hits, p50/p95 wall time and TTFT, tokens."""
+        with self._lock:
+            names = sorted({name for name, _ in self._counters})
+            rows = []
+            for name in names:
+                counters = {field: value for (call, field), value in self._counters.items() if call == name}
+                wall_times = list(self._wall_times[name])
+                ttfts = list(self._ttfts[name])
+                rows.append({
+                    'call': name,
+                    'calls': int(counters.get('calls', 0)),
+                    'errors': int(counters.get('errors', 0)),
+                    'cache_hits': int(counters.get('cache_hits', 0)),
+                    'p50 (s)': _percentile(wall_times, 0.5),
+                    'p95 (s)': _percentile(wall_times, 0.95),
+                    'p50 TTFT (s)': _percentile(ttfts, 0.5),
+                    'prompt tokens': int(counters.get('prompt_tokens', 0)),
+                    'completion tokens': int(counters.get('completion_tokens', 0)),
+                    'payload bytes': int(counters.get('payload_bytes', 0)),
+                })
+        return rows
+
+    def prometheus_text(self):
+        """The counters in the Prometheus text exposition format."""
+        metrics = [
+            ('app_calls_total', 'counter', 'calls', 'Instrumented calls.'),
+            ('app_call_errors_total', 'counter', 'errors', 'Calls that raised.'),
+            ('app_cache_hits_total', 'counter', 'cache_hits', 'Calls answered from a cache.'),
+            ('app_call_seconds_sum', 'counter', 'wall_time', 'Total wall time of calls.'),
+            ('app_call_ttft_seconds_sum', 'counter', 'ttft', 'Total time to first token of streams.'),
+            ('app_call_ttft_seconds_count', 'counter', 'ttft_count', 'Streams with a first token.'),
+            ('app_prompt_tokens_total', 'counter', 'prompt_tokens', 'Prompt tokens used.'),
+            ('app_completion_tokens_total', 'counter', 'completion_tokens', 'Completion tokens used.'),
+            ('app_payload_bytes_total', 'counter', 'payload_bytes', 'Request payload bytes sent.'),
+        ]
+        with self._lock:
+            counters = dict(self._counters)
+        lines = []
+        for metric, kind, field, help_text in metrics:
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {kind}')
+            for (name, counter_field), value in sorted(counters.items()):
+                if counter_field == field:
+                    lines.append(f'{metric}{{call="{name}"}} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+class _PrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = _served_metrics.prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_prometheus(metrics, port, host=DEFAULT_METRICS_HOST):
+    """
+    Serve metrics.prometheus_text() at http://host:port/metrics from a
+    daemon thread. The server is started once per process: later calls,
+    e.g. when Streamlit rebuilds a cached resource, only switch it to the
+    new metrics. Returns the server, or None if the port is already taken.
+    """
+    global _server, _served_metrics
+    with _server_lock:
+        _served_metrics = metrics
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _PrometheusHandler)
+            except OSError as error:
+                # e.g. a server left over from before this module was reloaded
+                logger.warning("Not serving metrics on %s:%s: %s", host, port, error)
+                return None
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+
+def render_metrics_panel(metrics, cache_stats=None):
+    """Sidebar expander with the per-call metrics and any cache statistics."""
+    with st.sidebar.expander('Metrics'):
+        rows = metrics.summary()
+        if rows:
+            st.dataframe(rows, hide_index=True)
+        else:
+            st.caption('No calls recorded yet.')
+        for name, stats in (cache_stats or {}).items():
+            st.caption(f"{name}: {stats['hits']} hits, {stats['misses']} misses")
@@ -0,0 +1,79 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+VALID_KEY_TTL = 60 * 60  # seconds
+INVALID_KEY_TTL = 60
+MAX_ENTRIES = 1024
+
+
+class KeyValidationCache:
+    """
+    Remembers API key validation results without keeping the keys: entries
+    are keyed on a salted HMAC of the key. Valid results are kept for
+    valid_ttl seconds, invalid ones only for invalid_ttl so a fixed key is
+    picked up quickly. At most max_entries results are kept, least recently
+    used first out. Concurrent validations of the same key share a single
+    network check. A validator returns None when it couldn't tell, e.g. on
+    a timeout; that result is not cached.
+    """
+
+    def __init__(self, valid_ttl=VALID_KEY_TTL, invalid_ttl=INVALID_KEY_TTL, max_entries=MAX_ENTRIES):
+        self.valid_ttl = valid_ttl
+        self.invalid_ttl = invalid_ttl
+        self.max_entries = max_entries
+        self._salt = os.urandom(16)
+        self._results = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _digest(self, validator, *parts):
+        # The validator is part of the key, so different checks of the same parts never share a result
+        message = '\0'.join((validator.__module__, validator.__qualname__) + parts).encode('utf-8')
+        return hmac.new(self._salt, message, hashlib.sha256).hexdigest()
+
+    def validate(self, validator, *key_parts):
+        """
+        Return validator(*key_parts), reusing a cached result for the same
+        key_parts (e.g. an API key and search engine id) while it is fresh.
+        """
+        digest = self._digest(validator, *key_parts)
+        while True:
+            with self._lock:
+                cached = self._results.get(digest)
+                if cached is not None and cached[0] > time.monotonic():
+                    self._results.move_to_end(digest)
+                    return cached[1]
+                event = self._in_flight.get(digest)
+                if event is None:
+                    event = self._in_flight[digest] = threading.Event()
+                    break
+            # Another thread is validating this key, wait for its result
+            event.wait()
+
+        try:
+            is_valid = validator(*key_parts)
+            if is_valid is None:
+                return None
+            is_valid = bool(is_valid)
+            ttl = self.valid_ttl if is_valid else self.invalid_ttl
+            with self._lock:
+                self._store(digest, is_valid, ttl)
+            return is_valid
+        finally:
+            with self._lock:
+                del self._in_flight[digest]
+            event.set()
+
+    def _store(self, digest, is_valid, ttl):
+        now = time.monotonic()
+        # Expiry order differs from insertion order (two TTLs), so sweep every entry
+        for expired in [key for key, (expires_at, _) in self._results.items() if expires_at <= now]:
+            del self._results[expired]
+        self._results[digest] = (now + ttl, is_valid)
+        self._results.move_to_end(digest)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
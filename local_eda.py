@@ -0,0 +1,128 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+IQR_FACTOR = 1.5
+Z_THRESHOLD = 3.0
+MAX_LISTED = 20
+
+
+def missing_values(df):
+    """Missing value counts, overall and for every column that has any."""
+    counts = df.isna().sum()
+    counts = counts[counts > 0].sort_values(ascending=False)
+    return {
+        "total_missing": int(counts.sum()),
+        "rows": len(df),
+        "by_column": {str(column): int(count) for column, count in counts.items()},
+    }
+
+
+def duplicate_rows(df, max_listed=MAX_LISTED):
+    """Fully duplicated rows: how many there are and the first few row indices."""
+    try:
+        duplicated = df.duplicated(keep='first')
+    except TypeError:
+        # Unhashable cells such as lists, compare their text form instead
+        duplicated = df.astype(str).duplicated(keep='first')
+    indices = df.index[duplicated.to_numpy()]
+    return {
+        "duplicate_rows": int(duplicated.sum()),
+        "first_duplicate_indices": [str(index) for index in indices[:max_listed]],
+    }
+
+
+def correlations(df, max_listed=MAX_LISTED):
+    """Pearson correlation matrix of the numeric columns and its strongest pairs."""
+    numeric = df.select_dtypes(include='number')
+    if len(numeric.columns) < 2:
+        return {"matrix": {}, "strongest_pairs": []}
+    matrix = numeric.corr()
+    values = matrix.to_numpy()
+    rows, columns = np.triu_indices_from(values, k=1)
+    pair_values = values[rows, columns]
+    keep = ~np.isnan(pair_values)
+    rows, columns, pair_values = rows[keep], columns[keep], pair_values[keep]
+    order = np.argsort(-np.abs(pair_values))[:max_listed]
+    names = matrix.columns
+    return {
+        "matrix": matrix.round(3).to_dict(),
+        "strongest_pairs": [
+            {"a": str(names[rows[i]]), "b": str(names[columns[i]]), "r": round(float(pair_values[i]), 3)}
+            for i in order
+        ],
+    }
+
+
+def outliers(df, iqr_factor=IQR_FACTOR, z_threshold=Z_THRESHOLD):
+    """Per numeric column outlier counts by the IQR rule and by z-score."""
+    numeric = df.select_dtypes(include='number').astype('float64')
+    if numeric.empty:
+        return {}
+    q1 = numeric.quantile(0.25)
+    q3 = numeric.quantile(0.75)
+    iqr = q3 - q1
+    lower = q1 - iqr_factor * iqr
+    upper = q3 + iqr_factor * iqr
+    iqr_counts = ((numeric < lower) | (numeric > upper)).sum()
+    z_scores = (numeric - numeric.mean()) / numeric.std(ddof=0).replace(0, np.nan)
+    z_counts = (z_scores.abs() > z_threshold).sum()
+    return {
+        str(column): {
+            "iqr_outliers": int(iqr_counts[column]),
+            "iqr_bounds": [round(float(lower[column]), 4), round(float(upper[column]), 4)],
+            "z_outliers": int(z_counts[column]),
+        }
+        for column in numeric.columns
+    }
+
+
+def normality(series):
+    """
+    Skewness, excess kurtosis and the Jarque-Bera normality test. JB is
+    chi-squared with 2 degrees of freedom, whose p-value is exp(-JB / 2).
+    """
+    values = series.dropna().to_numpy(dtype='float64')
+    n = len(values)
+    if n < 3 or np.all(values == values[0]):
+        return {"n": n, "skew": None, "excess_kurtosis": None, "jarque_bera": None, "p_value": None}
+    deviations = values - values.mean()
+    m2 = np.mean(deviations ** 2)
+    skew = np.mean(deviations ** 3) / m2 ** 1.5
+    excess_kurtosis = np.mean(deviations ** 4) / m2 ** 2 - 3
+    jarque_bera = n / 6 * (skew ** 2 + excess_kurtosis ** 2 / 4)
+    return {
+        "n": n,
+        "skew": round(float(skew), 4),
+        "excess_kurtosis": round(float(excess_kurtosis), 4),
+        "jarque_bera": round(float(jarque_bera), 4),
+        "p_value": float(np.exp(-jarque_bera / 2)),
+    }
+
+
+def variable_summary(series, max_listed=MAX_LISTED):
+    """Summary statistics of one column, plus a normality check for numeric columns."""
+    summary = {
+        "dtype": str(series.dtype),
+        "count": int(series.count()),
+        "missing": int(series.isna().sum()),
+    }
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        described = series.describe()
+        summary["statistics"] = {str(key): round(float(value), 4) for key, value in described.items()}
+        summary["normality"] = normality(series)
+    else:
+        counts = series.value_counts()
+        summary["distinct"] = int(counts.size)
+        summary["top_values"] = {str(value): int(count) for value, count in counts.head(max_listed).items()}
+    return summary
+
+
+def narration_prompt(topic, results):
+    """Prompt asking an LLM to explain computed results, without recomputing them."""
+    return (
+        f"These results were computed directly from the user's dataframe:\n"
+        f"{json.dumps(results, default=str)}\n\n"
+        f"Using only these numbers, explain {topic} to the user in a few sentences."
+    )
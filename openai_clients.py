@@ -0,0 +1,76 @@
+import hashlib
+import hmac
+import os
+import threading
+from collections import OrderedDict
+
+import openai
+from openai import DefaultHttpxClient, OpenAI
+
+# httpx's Limits class, taken from the build the installed openai package uses
+Limits = type(openai.DEFAULT_CONNECTION_LIMITS)
+
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 30.0  # seconds
+REQUEST_TIMEOUT = openai.Timeout(60.0, connect=5.0)
+MAX_RETRIES = 2
+MAX_CLIENTS = 64
+
+
+class OpenAIClientRegistry:
+    """
+    One pooled OpenAI client per API key, shared by every session that uses
+    that key. Clients are built once with tuned httpx connection limits, so
+    reruns reuse warm TLS connections, and each request carries its own key
+    instead of the process-wide openai.api_key. Keys are only held by their
+    clients; the registry is indexed by a salted HMAC of the key and keeps
+    at most max_clients, least recently used dropped first.
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry=KEEPALIVE_EXPIRY, timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES,
+                 max_clients=MAX_CLIENTS):
+        self.limits = Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_clients = max_clients
+        self._salt = os.urandom(16)
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, api_key):
+        return hmac.new(self._salt, api_key.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def get(self, api_key):
+        """Return the shared client for api_key, creating it on first use."""
+        digest = self._digest(api_key)
+        with self._lock:
+            client = self._clients.get(digest)
+            if client is not None:
+                self._clients.move_to_end(digest)
+                return client
+            client = OpenAI(
+                api_key=api_key,
+                max_retries=self.max_retries,
+                http_client=DefaultHttpxClient(limits=self.limits, timeout=self.timeout),
+            )
+            self._clients[digest] = client
+            # Dropped clients aren't closed, a session may still be mid-request
+            # on one; their connections are released when they're collected
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            return client
+
+    def discard(self, api_key):
+        """Forget the client for api_key, e.g. once the key turns out to be invalid."""
+        with self._lock:
+            self._clients.pop(self._digest(api_key), None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clients)
@@ -0,0 +1,471 @@
+import hashlib
+import json
+import math
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from sqlite_cache import SQLiteCache
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+CHUNK_ROWS = 100_000
+HLL_PRECISION = 14
+TDIGEST_COMPRESSION = 200
+TOP_K = 5
+TOP_K_CAPACITY = 1000
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+HASH_BLOCK_BYTES = 1024 ** 2
+PROFILE_CACHE_FILE = 'profiles.sqlite3'
+# Bump when the summary format changes, so stale cached summaries are ignored
+PROFILE_VERSION = 2
+
+
+class HyperLogLog:
+    """Approximate distinct count in 2**precision one-byte registers (about 1% error at 14)."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values):
+        hashes = pd.util.hash_array(np.asarray(values))
+        bits = 64 - self.precision
+        index = (hashes >> np.uint64(bits)).astype(np.intp)
+        rest = hashes & np.uint64((1 << bits) - 1)
+        # Rank of the first set bit; rest < 2**53, so frexp's exponent is exact
+        _, exponent = np.frexp(rest.astype(np.float64))
+        np.maximum.at(self.registers, index, (bits + 1 - exponent).astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class TDigest:
+    """
+    Quantile sketch of weighted centroids, at most about compression / 2 of
+    them, smaller near the tails where quantiles need more precision.
+    """
+
+    def __init__(self, compression=TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    def _absorb(self, means, weights):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        # Centroids whose left edge falls in the same unit of the k1 scale function are merged
+        q = (np.cumsum(weights) - weights) / weights.sum()
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        buckets = np.floor(k - k[0]).astype(np.intp)
+        totals = np.bincount(buckets, weights=weights)
+        sums = np.bincount(buckets, weights=means * weights)
+        used = totals > 0
+        self.means = sums[used] / totals[used]
+        self.weights = totals[used]
+
+    def update(self, values):
+        if len(values):
+            self._absorb(np.asarray(values, dtype=np.float64), np.ones(len(values)))
+
+    def merge(self, other):
+        if len(other.weights):
+            self._absorb(other.means, other.weights)
+
+    def quantile(self, q):
+        if not len(self.weights):
+            return None
+        midpoints = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * self.weights.sum(), midpoints, self.means))
+
+
+def _prune(counts, capacity):
+    # Misra-Gries reduction: subtract the (capacity + 1)-th largest count, drop what falls to zero.
+    # Returns the pruned counts and the amount subtracted from each.
+    if len(counts) <= capacity:
+        return counts, 0
+    threshold = counts.nlargest(capacity + 1).iloc[-1]
+    return counts[counts > threshold] - threshold, int(threshold)
+
+
+class FrequentValues:
+    """
+    Misra-Gries heavy hitters over value labels: keeps at most capacity
+    counters, each a lower bound on the true count. `error` is the most
+    any counter undercounts by, at most rows / (capacity + 1); it stays 0,
+    and the counts exact, while the values fit in capacity counters.
+    """
+
+    def __init__(self, capacity=TOP_K_CAPACITY):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype='int64')
+        self.error = 0
+
+    def _absorb(self, counts, error):
+        if len(self.counts):
+            counts = self.counts.add(counts, fill_value=0).astype('int64')
+        self.counts, threshold = _prune(counts, self.capacity)
+        self.error += error + threshold
+
+    def update(self, counts, error=0):
+        counts, threshold = _prune(counts, self.capacity)
+        self._absorb(counts, error + threshold)
+
+    def merge(self, other):
+        self._absorb(other.counts, other.error)
+
+    def top(self, k=TOP_K):
+        """
+        The k most frequent values as [label, count, exact]. Only counts
+        above the error are reported, as below it a value may not be
+        frequent at all; inexact counts are lower bounds.
+        """
+        counts = self.counts[self.counts > self.error].nlargest(k)
+        return [[label, int(count), self.error == 0] for label, count in counts.items()]
+
+
+def _kind(dtype):
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bool'
+    if pd.api.types.is_numeric_dtype(dtype):
+        return 'number'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    return 'text'
+
+
+def _labeled(counts, kind):
+    labels = counts.index.astype(str)
+    if kind == 'number':
+        # 5 and 5.0 are the same value, e.g. when a later chunk of the column has gaps
+        labels = labels.str.removesuffix('.0')
+    counts.index = labels
+    if not counts.index.is_unique:
+        counts = counts.groupby(level=0).sum()
+    return counts.astype('int64')
+
+
+def _combine_moments(a, b):
+    # Chan et al.'s pairwise update of (count, mean, sum of squared deviations)
+    count_a, mean_a, m2_a = a
+    count_b, mean_b, m2_b = b
+    count = count_a + count_b
+    if not count:
+        return a
+    delta = mean_b - mean_a
+    return count, mean_a + delta * count_b / count, m2_a + m2_b + delta * delta * count_a * count_b / count
+
+
+class ColumnProfile:
+    """Mergeable statistics of one column, updated a chunk at a time."""
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.kinds = set()
+        # Range, moments and quantiles follow the first numeric or datetime kind seen
+        self.stats_kind = None
+        self.min = None
+        self.max = None
+        self.moments = (0, 0.0, 0.0)
+        self.digest = TDigest()
+        self.distinct = HyperLogLog()
+        self.frequent = FrequentValues()
+
+    def update(self, series):
+        self.count += len(series)
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        if values.empty:
+            return
+        kind = _kind(values.dtype)
+        self.kinds.add(kind)
+        if isinstance(values.dtype, pd.DatetimeTZDtype):
+            values = values.dt.tz_convert(None)
+        counts = values.value_counts(sort=False)
+        counts = counts[counts > 0]
+        # Only the chunk's distinct values need hashing
+        if kind == 'number':
+            self.distinct.update(counts.index.to_numpy(np.float64))
+        elif kind == 'datetime':
+            self.distinct.update(counts.index.to_numpy('datetime64[ns]').view(np.int64))
+        else:
+            self.distinct.update(counts.index.to_numpy(object))
+        # Summarizing the chunk's counts first keeps labeling and merging cheap for high-cardinality columns
+        counts, error = _prune(counts, self.frequent.capacity)
+        self.frequent.update(_labeled(counts, kind), error)
+        if kind == 'number':
+            numbers = values.to_numpy(np.float64)
+        elif kind == 'datetime':
+            numbers = values.to_numpy('datetime64[ns]').view(np.int64).astype(np.float64)
+        else:
+            return
+
+        if self.stats_kind is None:
+            self.stats_kind = kind
+        if kind != self.stats_kind:
+            return
+        numbers = numbers[np.isfinite(numbers)]
+        if not len(numbers):
+            return
+        mean = numbers.mean()
+        self._update_stats(numbers.min(), numbers.max(), (len(numbers), mean, np.square(numbers - mean).sum()))
+        self.digest.update(numbers)
+
+    def _update_stats(self, low, high, moments):
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self.moments = _combine_moments(self.moments, moments)
+
+    def merge(self, other):
+        self.count += other.count
+        self.nulls += other.nulls
+        self.kinds |= other.kinds
+        self.distinct.merge(other.distinct)
+        self.frequent.merge(other.frequent)
+        if other.min is None:
+            return
+        if self.stats_kind is None:
+            self.stats_kind = other.stats_kind
+        if other.stats_kind == self.stats_kind:
+            self._update_stats(other.min, other.max, other.moments)
+            self.digest.merge(other.digest)
+
+    def _format(self, value, spread=False):
+        if value is None:
+            return None
+        if self.stats_kind == 'datetime':
+            # Estimates carry nanoseconds of float noise, seconds are plenty
+            if spread:
+                return str(pd.Timedelta(int(value)).round('s'))
+            return pd.Timestamp(int(value)).round('s').isoformat()
+        return round(float(value), 4)
+
+    def summary(self):
+        values = self.count - self.nulls
+        count, _, m2 = self.moments
+        summary = {
+            "Type": '/'.join(sorted(self.kinds)) or 'empty',
+            "Values": values,
+            "Missing": self.nulls,
+            "Missing (%)": round(100 * self.nulls / self.count, 2) if self.count else 0.0,
+            "Distinct (approx.)": min(self.distinct.count(), values),
+            "Min": self._format(self.min),
+            "Max": self._format(self.max),
+            "Mean": self._format(self.moments[1] if count else None),
+            "Std": self._format(math.sqrt(m2 / (count - 1)) if count > 1 else None, spread=True),
+        }
+        for q in QUANTILES:
+            value = self.digest.quantile(q)
+            if value is not None:
+                # The sketch interpolates, keep its estimates inside the exact range
+                value = min(max(value, self.min), self.max)
+            summary[f"{q:.0%}"] = self._format(value)
+        summary["Top values"] = self.frequent.top()
+        return summary
+
+
+class DatasetProfile:
+    """Per-column sketches of a dataset; profiles of disjoint chunks merge into the whole's."""
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = {}
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        for position, name in enumerate(chunk.columns):
+            self.columns.setdefault(str(name), ColumnProfile()).update(chunk.iloc[:, position])
+        return self
+
+    def merge(self, other):
+        self.rows += other.rows
+        for name, column in other.columns.items():
+            if name in self.columns:
+                self.columns[name].merge(column)
+            else:
+                self.columns[name] = column
+        return self
+
+    def summary(self):
+        return {
+            "Rows": self.rows,
+            "Columns": len(self.columns),
+            "Column profiles": [{"Column": name, **column.summary()} for name, column in self.columns.items()],
+        }
+
+
+def _source_kind(source):
+    name = (source if isinstance(source, str) else getattr(source, 'name', '')).lower()
+    if name.endswith(('.csv', '.csv.gz')):
+        return 'csv'
+    if name.endswith('.xls'):
+        return 'xls'
+    if name.endswith(('.xlsx', '.xlsm')):
+        return 'xlsx'
+    return None
+
+
+def _column_names(header):
+    # Named the way pandas names them: blanks become "Unnamed: i", repeats get a ".n" suffix
+    names = []
+    seen = {}
+    for i, value in enumerate(header):
+        name = f"Unnamed: {i}" if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def iter_csv_chunks(source, chunksize=CHUNK_ROWS):
+    with pd.read_csv(source, chunksize=chunksize) as reader:
+        yield from reader
+
+
+def iter_excel_chunks(source, sheet_name=None, chunksize=CHUNK_ROWS):
+    """
+    Rows of one sheet (the first by default) as DataFrames of chunksize
+    rows, streamed with openpyxl's read-only mode so the sheet is never
+    held in memory whole.
+    """
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0] if sheet_name is None else workbook[sheet_name]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = _column_names(header)
+        width = len(columns)
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(tuple(row[:width]) + (None,) * (width - len(row)))
+            if len(batch) == chunksize:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def iter_chunks(source, sheet_name=None, chunksize=CHUNK_ROWS):
+    """DataFrame chunks of a CSV or Excel path or file object."""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    kind = _source_kind(source)
+    if kind == 'csv':
+        return iter_csv_chunks(source, chunksize)
+    if kind == 'xlsx' and openpyxl is not None:
+        return iter_excel_chunks(source, sheet_name, chunksize)
+    # Legacy .xls can't be streamed, it is read whole
+    return iter([pd.read_excel(source, sheet_name=0 if sheet_name is None else sheet_name)])
+
+
+def _profile_chunk(chunk):
+    return DatasetProfile().update(chunk)
+
+
+def profile_chunks(chunks, max_workers=1):
+    """
+    Profile an iterable of DataFrame chunks in one pass. With several
+    workers, chunks are profiled in worker processes and their partial
+    profiles merged; at most two chunks per worker are in flight, so
+    memory stays bounded however many chunks there are.
+    """
+    profile = DatasetProfile()
+    if max_workers <= 1:
+        for chunk in chunks:
+            profile.update(chunk)
+        return profile
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        pending = set()
+        for chunk in chunks:
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    profile.merge(future.result())
+            pending.add(executor.submit(_profile_chunk, chunk))
+        for future in pending:
+            profile.merge(future.result())
+    return profile
+
+
+def profile_frame(df, chunksize=CHUNK_ROWS):
+    return profile_chunks(df.iloc[start:start + chunksize] for start in range(0, len(df), chunksize))
+
+
+def profile_file(source, sheet_name=None, chunksize=CHUNK_ROWS, max_workers=1):
+    """Profile a CSV or Excel file (path or file object) larger than memory, a chunk at a time."""
+    return profile_chunks(iter_chunks(source, sheet_name, chunksize), max_workers)
+
+
+def file_digest(source):
+    """SHA-256 of a path's or file object's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    if hasattr(source, 'read'):
+        source.seek(0)
+        for block in iter(lambda: source.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+        source.seek(0)
+    else:
+        with open(source, 'rb') as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_BYTES), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class ProfileCache:
+    """Dataset profile summaries cached by a hash of the file's content and the sheet profiled."""
+
+    def __init__(self, path=PROFILE_CACHE_FILE, ttl=None, max_entries=1000):
+        self._store = SQLiteCache(path, table='profiles', ttl=ttl, max_entries=max_entries)
+
+    def profile(self, source, digest=None, sheet_name=None, chunksize=CHUNK_ROWS, max_workers=1):
+        key = json.dumps([PROFILE_VERSION, digest or file_digest(source), sheet_name])
+        summary = self._store.get(key)
+        if summary is None:
+            summary = profile_file(source, sheet_name, chunksize, max_workers).summary()
+            self._store.set(key, summary)
+        return summary
+
+
+def render_profile(summary):
+    """Dataset size and one row of statistics per column."""
+    st.caption(f"{summary['Rows']:,} rows × {summary['Columns']:,} columns. Distinct counts and percentiles are estimates; top value counts marked ≥ are lower bounds.")
+    frame = pd.DataFrame(summary["Column profiles"]).set_index("Column")
+    frame["Top values"] = [
+        ", ".join(f"{label} ({'' if exact else '≥ '}{count:,})" for label, count, exact in top)
+        or ("none above the error bound" if values else "")
+        for top, values in zip(frame["Top values"], frame["Values"])
+    ]
+    # Numeric and datetime columns share the statistic columns, show them all as text
+    for column in frame.select_dtypes(include='object').columns:
+        frame[column] = frame[column].map(lambda value: "" if value is None else str(value))
+    st.dataframe(frame)
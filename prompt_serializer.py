@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+from context_window import count_tokens
+
+DEFAULT_TOKEN_BUDGET = 3000
+QUANTILES = [0.0, 0.25, 0.5, 0.75, 1.0]
+TOP_K = 5
+MAX_STRATA = 20
+MAX_CELL_CHARS = 80
+
+
+def _format_number(value):
+    if pd.isna(value):
+        return 'nan'
+    return f"{value:.6g}"
+
+
+def column_summaries(df, top_k=TOP_K):
+    """One line per column: dtype, null rate and quantiles or top-k values."""
+    null_rates = df.isna().mean()
+    numeric = df.select_dtypes(include='number')
+    # Quantiles and means for every numeric column in one vectorized pass
+    quantiles = numeric.quantile(QUANTILES) if len(numeric.columns) else None
+    means = numeric.mean() if len(numeric.columns) else None
+
+    lines = []
+    for column in df.columns:
+        line = f"- {column} ({df[column].dtype}), nulls {null_rates[column]:.1%}"
+        if column in numeric.columns:
+            q = quantiles[column]
+            line += (
+                f", min {_format_number(q[0.0])}, p25 {_format_number(q[0.25])}, "
+                f"median {_format_number(q[0.5])}, p75 {_format_number(q[0.75])}, "
+                f"max {_format_number(q[1.0])}, mean {_format_number(means[column])}"
+            )
+        else:
+            counts = df[column].value_counts(dropna=True)
+            top = ', '.join(f"{str(value)[:MAX_CELL_CHARS]} ({count})" for value, count in counts.head(top_k).items())
+            line += f", {counts.size} distinct, top: {top}"
+        lines.append(line)
+    return lines
+
+
+def _stratify_column(df):
+    # The lowest-cardinality categorical/text column with a few groups, if any
+    candidates = []
+    for column in df.select_dtypes(exclude='number').columns:
+        groups = df[column].nunique(dropna=False)
+        if 1 < groups <= MAX_STRATA:
+            candidates.append((groups, column))
+    return min(candidates)[1] if candidates else None
+
+
+def sample_rows(df, n, seed=0):
+    """
+    A representative sample of n rows: stratified on a low-cardinality column
+    when there is one, evenly spaced through the frame otherwise. Rows keep
+    their original order.
+    """
+    if n >= len(df):
+        return df
+    if n <= 0:
+        return df.iloc[0:0]
+    column = _stratify_column(df)
+    if column is not None:
+        sample = df.groupby(column, observed=True, dropna=False, group_keys=False).sample(
+            frac=n / len(df), random_state=seed
+        )
+        if len(sample) > 0:
+            return sample.sort_index()
+    positions = np.unique(np.linspace(0, len(df) - 1, n).astype(int))
+    return df.iloc[positions]
+
+
+def _rows_text(rows, fmt):
+    # Long text cells are cut so one row can't take the whole budget
+    rows = rows.apply(
+        lambda column: column if pd.api.types.is_numeric_dtype(column) else column.astype(str).str.slice(0, MAX_CELL_CHARS)
+    )
+    if fmt == 'markdown':
+        header = '| ' + ' | '.join(map(str, rows.columns)) + ' |'
+        divider = '|' + '---|' * len(rows.columns)
+        body = ['| ' + ' | '.join(map(str, values)) + ' |' for values in rows.itertuples(index=False)]
+        return '\n'.join([header, divider] + body)
+    return rows.to_csv(index=False, float_format='%.6g').strip()
+
+
+def serialize_dataframe(df, token_budget=DEFAULT_TOKEN_BUDGET, fmt='csv'):
+    """
+    Describe a DataFrame for an LLM prompt within roughly token_budget tokens:
+    the shape, a per-column summary (null rate, quantiles or top values) and
+    a stratified row sample as compact CSV (or markdown with fmt='markdown').
+    The size stays bounded however many rows the frame has.
+    """
+    header = f"Shape: {len(df):,} rows x {len(df.columns)} columns"
+    remaining = token_budget - count_tokens(header)
+
+    # Column summaries come first; very wide frames are cut off at half the budget
+    summary_lines = []
+    for line in column_summaries(df):
+        tokens = count_tokens(line)
+        if tokens > remaining - token_budget // 2:
+            summary_lines.append(f"- ... {len(df.columns) - len(summary_lines)} more columns")
+            break
+        summary_lines.append(line)
+        remaining -= tokens
+
+    # Size the sample from the cost of a few rows, then shrink until it fits
+    probe = _rows_text(df.head(5), fmt)
+    rows_in_probe = max(min(len(df), 5), 1)
+    tokens_per_row = max(count_tokens(probe) / (rows_in_probe + 1), 1)
+    n = int(remaining // tokens_per_row) - 1
+    while True:
+        sample = sample_rows(df, n)
+        rows_text = _rows_text(sample, fmt)
+        if count_tokens(rows_text) <= remaining or n <= 1:
+            break
+        n //= 2
+
+    sample_note = f"Sample of {len(sample):,} rows" if len(sample) < len(df) else "All rows"
+    return '\n'.join([header, 'Columns:'] + summary_lines + [f"{sample_note}:", rows_text])
@@ -0,0 +1,518 @@
+import codecs
+import hashlib
+import ipaddress
+import json
+import os
+import re
+import socket
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+from urllib.request import url2pathname
+
+import numpy as np
+
+import http_client
+from context_window import count_tokens
+from sqlite_cache import SQLiteCache
+
+RETRIEVAL_DIR = '.retrieval'
+PAGE_TTL = 24 * 60 * 60  # seconds before a page is fetched again
+FAILED_PAGE_TTL = 60 * 60
+MAX_PAGES = 10000
+MAX_PAGE_BYTES = 2 * 1024 ** 2
+PAGE_READ_TIMEOUT = 5
+MAX_REDIRECTS = 5
+PAGE_FETCH_TIMEOUT = 10  # seconds for a whole page, however slowly it trickles in
+RETRIEVAL_TIMEOUT = 8  # seconds for all of a turn's pages, later ones fall back to their snippet
+FETCH_WORKERS = 8
+CHUNK_TOKENS = 200
+MAX_CHUNKS_PER_PAGE = 40
+EMBED_BATCH = 256
+TOP_K = 8
+CONTEXT_TOKENS = 3000
+SEARCH_BLOCK_ROWS = 65536
+# An index is compacted once it holds COMPACT_RATIO times more rows than live pages use
+COMPACT_MIN_ROWS = 10000
+COMPACT_RATIO = 2
+# Passages must score above MIN_SCORE and within MIN_RELATIVE_SCORE of the best one
+MIN_SCORE = 0.0
+MIN_RELATIVE_SCORE = 0.5
+
+# Contents of these tags never reach the prompt
+SKIPPED_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'nav', 'header', 'footer', 'aside', 'form'}
+BLOCK_TAGS = {
+    'p', 'div', 'br', 'li', 'ul', 'ol', 'tr', 'td', 'th', 'table', 'section', 'article', 'main',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'dd', 'dt',
+}
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.title = []
+        self._skip_depth = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == 'title':
+            self._in_title = True
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag == 'title':
+            self._in_title = False
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title.append(data)
+        elif not self._skip_depth:
+            self.parts.append(data)
+
+
+def extract_text(html):
+    """Title and readable text of an HTML page, one paragraph per line, without scripts or navigation."""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    lines = (' '.join(line.split()) for line in ''.join(parser.parts).splitlines())
+    return ' '.join(''.join(parser.title).split()), '\n'.join(line for line in lines if line)
+
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS):
+    """Split text into passages of about max_tokens, keeping paragraphs whole where they fit."""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for paragraph in text.splitlines():
+        tokens = count_tokens(paragraph)
+        if tokens > max_tokens:
+            # Long paragraphs are cut into word windows of roughly max_tokens
+            words = paragraph.split()
+            step = max(max_tokens * 3 // 4, 1)
+            pieces = [' '.join(words[i:i + step]) for i in range(0, len(words), step)]
+        else:
+            pieces = [paragraph]
+        for piece in pieces:
+            tokens = count_tokens(piece)
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append('\n'.join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def _check_url(url, allow_private=False):
+    # Only public http(s) hosts, so a search result can't reach this machine or its network
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError(f"Unsupported URL {url!r}")
+    if allow_private:
+        return
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    for *_, address in socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP):
+        if not ipaddress.ip_address(address[0].split('%')[0]).is_global:
+            raise ValueError(f"{url!r} resolves to a non-public address")
+
+
+def _charset(content_type, body):
+    # The header's charset, else the page's own <meta charset>, else UTF-8
+    match = re.search(r'charset=["\']?([\w.:-]+)', content_type, re.I)
+    if match is None:
+        match = re.search(rb'<meta[^>]+charset=["\']?([\w.:-]+)', body[:4096], re.I)
+    encoding = match.group(1) if match else 'utf-8'
+    if isinstance(encoding, bytes):
+        encoding = encoding.decode('ascii')
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        return 'utf-8'
+    return encoding
+
+
+def fetch_page(url, max_bytes=MAX_PAGE_BYTES, timeout=PAGE_FETCH_TIMEOUT, allow_private=False):
+    """
+    (title, text) of an HTML or plain-text page over http(s), reading at
+    most max_bytes and for at most timeout seconds. Redirects are followed
+    by hand, and every hop must be a public http(s) address unless
+    allow_private, e.g. for a local stub server. Pages are fetched through
+    a cookieless session of their own.
+    """
+    deadline = time.monotonic() + timeout
+    for _ in range(MAX_REDIRECTS + 1):
+        _check_url(url, allow_private)
+        response = http_client.get(
+            url, timeout=(http_client.CONNECT_TIMEOUT, PAGE_READ_TIMEOUT), retries=1, stream=True,
+            allow_redirects=False, session=http_client.get_page_session(),
+        )
+        if not response.is_redirect:
+            break
+        response.close()
+        url = urljoin(url, response.headers['Location'])
+    else:
+        raise ValueError(f"Too many redirects from {url!r}")
+    with response:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        if 'html' not in content_type and not content_type.startswith('text/plain'):
+            raise ValueError(f"Unsupported content type {content_type!r}")
+        body = bytearray()
+        while len(body) < max_bytes:
+            # read1 returns whatever has arrived, so a page trickling in is still checked
+            # against the deadline; the read timeout only bounds the gap between blocks
+            block = response.raw.read1(64 * 1024, decode_content=True)
+            if not block:
+                break
+            body += block
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{url} took longer than {timeout}s")
+    body = bytes(body[:max_bytes])
+    text = body.decode(_charset(content_type, body), errors='replace')
+    if 'html' in content_type:
+        return extract_text(text)
+    return '', text
+
+
+def fetch_file(url, max_bytes=MAX_PAGE_BYTES):
+    """(title, text) of a file:// HTML page, e.g. fixtures in tests: Retriever(fetch=fetch_file)."""
+    parsed = urlparse(url)
+    if parsed.scheme != 'file':
+        raise ValueError(f"Not a file:// URL: {url!r}")
+    with open(url2pathname(parsed.path), 'rb') as file:
+        body = file.read(max_bytes).decode('utf-8', errors='replace')
+    return extract_text(body)
+
+
+def _normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class HashingEmbedder:
+    """
+    Offline stand-in for an embedding model: a hashed bag of words. Texts
+    sharing words score high, which is enough for tests and benchmarks.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in re.findall(r'\w+', text.casefold()):
+                vectors[i, zlib.crc32(word.encode('utf-8')) % self.dim] += 1
+        return vectors
+
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API, shortened to dim dimensions to keep the index small."""
+
+    def __init__(self, client, model='text-embedding-3-small', dim=512):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.name = f"{model}-{dim}"
+
+    def __call__(self, texts):
+        response = self.client.embeddings.create(model=self.model, input=list(texts), dimensions=self.dim)
+        return np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)], dtype=np.float32)
+
+
+class VectorIndex:
+    """
+    Append-only file of unit-length float32 vectors, memory-mapped for
+    search, so cosine similarity is a dot product and the index never has
+    to fit in memory. compact() rewrites it without the rows no longer used.
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self._row_bytes = dim * np.dtype(np.float32).itemsize
+        self._lock = threading.Lock()
+        self._matrix = None
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.path) // self._row_bytes
+        except FileNotFoundError:
+            return 0
+
+    def add(self, vectors):
+        """Append vectors and return the row number of the first one."""
+        vectors = _normalized(vectors).reshape(-1, self.dim)
+        with self._lock, open(self.path, 'ab') as file:
+            start = file.tell() // self._row_bytes
+            # Drop a partial row left behind by an interrupted write
+            file.truncate(start * self._row_bytes)
+            file.write(vectors.tobytes())
+        return start
+
+    def compact(self, ranges):
+        """
+        Rewrite the file with only the (start, count) row ranges given, in
+        order. Returns the new start of each range.
+        """
+        matrix = self._rows()
+        tmp_path = f"{self.path}.tmp"
+        starts = []
+        with self._lock:
+            with open(tmp_path, 'wb') as file:
+                for start, count in ranges:
+                    starts.append(file.tell() // self._row_bytes)
+                    file.write(np.ascontiguousarray(matrix[start:start + count]).tobytes())
+            os.replace(tmp_path, self.path)
+            self._matrix = None
+        return starts
+
+    def _rows(self):
+        rows = len(self)
+        with self._lock:
+            if self._matrix is None or len(self._matrix) != rows:
+                self._matrix = np.memmap(self.path, dtype=np.float32, mode='r', shape=(rows, self.dim)) if rows else None
+            return self._matrix
+
+    def search(self, query, k=TOP_K, rows=None):
+        """(row, cosine similarity) of the k rows nearest to query, among `rows` when given."""
+        matrix = self._rows()
+        if matrix is None:
+            return []
+        query = _normalized(query).reshape(self.dim)
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.intp)
+            scores = matrix[rows] @ query
+        else:
+            # Blocks of rows, so only one block is paged in at a time
+            rows = np.arange(len(matrix))
+            scores = np.concatenate([
+                matrix[start:start + SEARCH_BLOCK_ROWS] @ query for start in range(0, len(matrix), SEARCH_BLOCK_ROWS)
+            ])
+        if not len(scores):
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+
+def _page(title, chunks):
+    return {
+        'title': title,
+        'content_hash': hashlib.sha256('\n'.join(chunks).encode('utf-8')).hexdigest(),
+        'chunks': chunks,
+    }
+
+
+def _snippet_page(result):
+    return _page(result.get('title', ''), [result.get('snippet', '')])
+
+
+class Retriever:
+    """
+    Retrieval over the pages behind search results. Pages are fetched
+    concurrently, reduced to text and split into passages; the passages
+    are embedded into a VectorIndex per embedding model and the ones
+    nearest the query are returned. Page passages are cached by URL for
+    page_ttl, and their vectors by content hash, so a popular page is
+    fetched once a day at most and embedded only when its text changes;
+    the index is compacted once most of its vectors belong to evicted or
+    changed pages. Pages that can't be fetched, or not within timeout seconds of the
+    turn, fall back to the search result's snippet.
+    """
+
+    def __init__(self, root=RETRIEVAL_DIR, fetch=fetch_page, page_ttl=PAGE_TTL, max_pages=MAX_PAGES,
+                 max_workers=FETCH_WORKERS, timeout=RETRIEVAL_TIMEOUT):
+        self.root = root
+        self.fetch = fetch
+        self.max_workers = max_workers
+        self.timeout = timeout
+        os.makedirs(root, exist_ok=True)
+        store_path = os.path.join(root, 'pages.sqlite3')
+        self._pages = SQLiteCache(store_path, table='pages', ttl=page_ttl, max_entries=max_pages)
+        # (embedding model, content hash) -> [first row, rows] of the page's vectors in that model's index
+        self._embedded = SQLiteCache(store_path, table='embedded', max_entries=max_pages * 4)
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        # Page cache hits and misses, as for the other caches
+        self.hits = 0
+        self.misses = 0
+        self.chunks_embedded = 0
+
+    def index(self, embed):
+        with self._lock:
+            index = self._indexes.get(embed.name)
+            if index is None:
+                path = os.path.join(self.root, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', embed.name)}.f32")
+                index = self._indexes[embed.name] = VectorIndex(path, embed.dim)
+            return index
+
+    def _load_page(self, result):
+        try:
+            title, text = self.fetch(result['link'])
+            ttl = None
+        except Exception:
+            title, text = '', ''
+            ttl = FAILED_PAGE_TTL
+        chunks = chunk_text(text)[:MAX_CHUNKS_PER_PAGE]
+        if chunks:
+            page = _page(title or result.get('title', ''), chunks)
+        else:
+            # Nothing readable, retry sooner and make do with the snippet until then
+            page = _snippet_page(result)
+            ttl = FAILED_PAGE_TTL
+        self._pages.set(result['link'], page, ttl=ttl)
+        return page
+
+    def pages(self, results):
+        """Cached or freshly fetched pages of search results, keyed by link."""
+        pages = {}
+        missing = []
+        for result in results:
+            page = self._pages.get(result['link'])
+            if page is None:
+                missing.append(result)
+            else:
+                pages[result['link']] = page
+        if missing:
+            executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing)))
+            futures = [executor.submit(self._load_page, result) for result in missing]
+            wait(futures, timeout=self.timeout)
+            # Fetches still running finish in the background and are cached for the next turn
+            executor.shutdown(wait=False, cancel_futures=True)
+            for result, future in zip(missing, futures):
+                if future.done() and not future.cancelled():
+                    pages[result['link']] = future.result()
+                else:
+                    pages[result['link']] = _snippet_page(result)
+        with self._lock:
+            self.hits += len(pages) - len(missing)
+            self.misses += len(missing)
+        return pages
+
+    def _embedded_start(self, embed, content_hash):
+        entry = self._embedded.get(json.dumps([embed.name, content_hash]))
+        # Entries from before row counts were kept can't be compacted, they are embedded again
+        return entry[0] if isinstance(entry, list) else None
+
+    def _embed_pending(self, pages, embed):
+        # Vectors of the pages this model hasn't seen yet, by content hash
+        pending = {}
+        for page in pages.values():
+            content_hash = page['content_hash']
+            if content_hash not in pending and self._embedded_start(embed, content_hash) is None:
+                pending[content_hash] = page['chunks']
+        if not pending:
+            return {}
+        texts = [chunk for chunks in pending.values() for chunk in chunks]
+        vectors = np.concatenate([embed(texts[i:i + EMBED_BATCH]) for i in range(0, len(texts), EMBED_BATCH)])
+        with self._lock:
+            self.chunks_embedded += len(texts)
+        embedded = {}
+        offset = 0
+        for content_hash, chunks in pending.items():
+            embedded[content_hash] = vectors[offset:offset + len(chunks)]
+            offset += len(chunks)
+        return embedded
+
+    def _add_vectors(self, embed, embedded):
+        # Called with _index_lock held; another turn may have added the same page meanwhile
+        embedded = {
+            content_hash: vectors for content_hash, vectors in embedded.items()
+            if self._embedded_start(embed, content_hash) is None
+        }
+        if not embedded:
+            return
+        index = self.index(embed)
+        first_row = index.add(np.concatenate(list(embedded.values())))
+        entries = []
+        for content_hash, vectors in embedded.items():
+            entries.append((json.dumps([embed.name, content_hash]), [first_row, len(vectors)]))
+            first_row += len(vectors)
+        self._embedded.set_many(entries)
+        self._compact(embed, index)
+
+    def _compact(self, embed, index):
+        # Rows of evicted or changed pages are dropped once they outnumber the live ones
+        rows = len(index)
+        if rows < COMPACT_MIN_ROWS:
+            return
+        live = [
+            (key, entry) for key, entry in self._embedded.items()
+            if json.loads(key)[0] == embed.name and isinstance(entry, list)
+        ]
+        if rows <= COMPACT_RATIO * sum(count for _, (_, count) in live):
+            return
+        live.sort(key=lambda item: item[1][0])
+        starts = index.compact([tuple(entry) for _, entry in live])
+        self._embedded.set_many([(key, [start, count]) for (key, (_, count)), start in zip(live, starts)])
+
+    def retrieve(self, query, results, embed, k=TOP_K, min_score=MIN_SCORE, min_relative_score=MIN_RELATIVE_SCORE):
+        """
+        The k passages of the results' pages most similar to query, best
+        first, as dicts with url, title, text and score. Passages scoring
+        min_score or less, or below min_relative_score times the best
+        score, are left out.
+        """
+        pages = self.pages(results)
+        if not pages:
+            return []
+        embedded = self._embed_pending(pages, embed)
+        query_vector = embed([query])[0]
+        # Rows only move while the lock is held, so looked-up rows stay valid for the search
+        with self._index_lock:
+            self._add_vectors(embed, embedded)
+            passages = {}
+            for url, page in pages.items():
+                start = self._embedded_start(embed, page['content_hash'])
+                if start is None:
+                    continue
+                for i, chunk in enumerate(page['chunks']):
+                    passages.setdefault(start + i, {'url': url, 'title': page['title'], 'text': chunk})
+            if not passages:
+                return []
+            nearest = self.index(embed).search(query_vector, k, rows=list(passages))
+        if not nearest:
+            return []
+        cutoff = nearest[0][1] * min_relative_score
+        return [{**passages[row], 'score': score} for row, score in nearest if score > min_score and score >= cutoff]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'passages embedded': self.chunks_embedded}
+
+
+def build_context(passages, max_tokens=CONTEXT_TOKENS):
+    """
+    Prompt text of the best passages that fit in max_tokens, each labelled
+    with its source. Returns the text and the passages used.
+    """
+    parts = []
+    used = []
+    tokens = 0
+    for passage in passages:
+        part = f"[{len(used) + 1}] {passage['title']} ({passage['url']})\n{passage['text']}"
+        part_tokens = count_tokens(part)
+        if tokens + part_tokens > max_tokens:
+            continue
+        parts.append(part)
+        used.append(passage)
+        tokens += part_tokens
+    return '\n\n'.join(parts), used
@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_cache import SQLiteCache
+
+SEARCH_CACHE_TTL = 6 * 60 * 60  # seconds
+SEARCH_CACHE_MAX_ENTRIES = 1000
+
+
+def normalize_query(query):
+    return ' '.join(query.casefold().split())
+
+
+def search_cache_key(query, cse_id, excluded_domains=None, start=1):
+    return json.dumps([normalize_query(query), cse_id, sorted(excluded_domains or []), start])
+
+
+class SearchCache:
+    """
+    TTL + LRU cache for web search results keyed on the normalized query,
+    search engine id, excluded domains and result page offset. Entries live
+    in memory and, when persist_path is given, in a SQLite file so they
+    survive restarts.
+    """
+
+    def __init__(self, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES, persist_path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if persist_path:
+            self._disk = SQLiteCache(persist_path, table='search_results', ttl=ttl, max_entries=max_entries)
+
+    def get(self, query, cse_id, excluded_domains=None, start=1):
+        key = search_cache_key(query, cse_id, excluded_domains, start)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+            self._entries.pop(key, None)
+
+        results, expires_at = self._disk.get_with_expiry(key) if self._disk is not None else (None, None)
+        with self._lock:
+            if results is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Keep the disk entry's remaining lifetime rather than starting a fresh TTL
+            ttl = self.ttl if expires_at is None else expires_at - time.time()
+            self._put(key, results, now + ttl)
+        return list(results)
+
+    def set(self, query, cse_id, excluded_domains, results, start=1):
+        key = search_cache_key(query, cse_id, excluded_domains, start)
+        with self._lock:
+            self._put(key, results, time.monotonic() + self.ttl)
+        if self._disk is not None:
+            self._disk.set(key, results)
+
+    def _put(self, key, results, expires_at):
+        self._entries[key] = (expires_at, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
@@ -0,0 +1,64 @@
+import asyncio
+import functools
+import threading
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Google Custom Search `start` offsets, i.e. the first two result pages
+SEARCH_START_OFFSETS = (1, 11)
+
+
+def merge_results(result_lists):
+    # Keep the first occurrence of each link, in page order
+    merged = []
+    seen_links = set()
+    for results in result_lists:
+        for result in results:
+            if result['link'] not in seen_links:
+                seen_links.add(result['link'])
+                merged.append(result)
+    return merged
+
+
+async def _gather(calls, script_ctx):
+    def in_script_ctx(call):
+        # Worker threads need the script context to use st.cache_* helpers
+        add_script_run_ctx(threading.current_thread(), script_ctx)
+        return call()
+
+    return await asyncio.gather(
+        *(asyncio.to_thread(in_script_ctx, call) for call in calls),
+        return_exceptions=True,
+    )
+
+
+def run_concurrently(*calls):
+    """Run blocking calls concurrently and return their results (or exceptions) in order."""
+    return asyncio.run(_gather(calls, get_script_run_ctx()))
+
+
+def search_turn(query, search, prepare=None, reformulations=(), start_offsets=SEARCH_START_OFFSETS):
+    """
+    Issue search(query, start) for the query, its reformulations and every
+    result page concurrently, together with prepare() (e.g. context
+    preparation). Returns the merged, deduplicated results and prepare()'s
+    return value. Individual failed searches are skipped; if every search
+    fails the first error is raised.
+    """
+    queries = [query] + [q for q in reformulations if q != query]
+    search_calls = [functools.partial(search, q, start) for q in queries for start in start_offsets]
+    calls = search_calls + ([prepare] if prepare is not None else [])
+    outcomes = run_concurrently(*calls)
+
+    search_outcomes = outcomes[:len(search_calls)]
+    prepared = None
+    if prepare is not None:
+        prepared = outcomes[-1]
+        if isinstance(prepared, BaseException):
+            raise prepared
+
+    failures = [outcome for outcome in search_outcomes if isinstance(outcome, BaseException)]
+    if len(failures) == len(search_outcomes):
+        raise failures[0]
+    results = merge_results(outcome for outcome in search_outcomes if not isinstance(outcome, BaseException))
+    return results, prepared
@@ -0,0 +1,102 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class SQLiteCache:
+    """
+    Small persistent key/value cache backed by a SQLite file in WAL mode.
+    Values are stored as JSON, expire after ttl seconds (None keeps them
+    forever) and the least recently used entries are evicted past
+    max_entries.
+    """
+
+    def __init__(self, path, table='cache', ttl=None, max_entries=10000):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed_at)')
+
+    def get(self, key):
+        return self.get_with_expiry(key)[0]
+
+    def get_with_expiry(self, key):
+        """(value, expires_at) for key, expires_at as a time.time() or None; (None, None) when missing."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None, None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                return None, None
+            self._conn.execute(f'UPDATE {self.table} SET accessed_at = ? WHERE key = ?', (now, key))
+        return json.loads(value), expires_at
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), expires_at, now),
+            )
+            self._evict(now)
+
+    def set_many(self, items, ttl=None):
+        """Set several (key, value) pairs in one transaction."""
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(
+                    f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                    [(key, json.dumps(value), expires_at, now) for key, value in items],
+                )
+                self._evict(now)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def items(self):
+        """(key, value) of every unexpired entry, without touching their recency."""
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT key, value FROM {self.table} WHERE expires_at IS NULL OR expires_at > ?', (time.time(),)
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def _evict(self, now):
+        self._conn.execute(f'DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?', (now,))
+        count = self._conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                f'DELETE FROM {self.table} WHERE key IN ('
+                f'SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)',
+                (count - self.max_entries,),
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
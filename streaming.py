@@ -0,0 +1,52 @@
+import time
+
+
+class TurnTimer:
+    """
+    Wall-clock timing for one chat turn: time-to-first-token and total
+    latency, both measured from when the timer was created (the user's
+    submit).
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+
+    def stream_text(self, stream):
+        # Yield the text deltas of a chat completion stream, recording timings
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if self.first_token_at is None:
+                    self.first_token_at = time.perf_counter()
+                yield delta
+        self.finish()
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+
+    @property
+    def ttft(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    @property
+    def latency(self):
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    def as_dict(self):
+        return {
+            "ttft": round(self.ttft, 3) if self.ttft is not None else None,
+            "latency": round(self.latency, 3),
+        }
+
+    def summary(self):
+        if self.ttft is None:
+            return f"Total {self.latency:.2f}s"
+        return f"First token {self.ttft:.2f}s · total {self.latency:.2f}s"
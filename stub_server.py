@@ -0,0 +1,192 @@
+"""
+Local stand-in for the OpenAI and Google Custom Search APIs, for benchmarks
+and offline runs. Point the apps at it with
+
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+    GOOGLE_SEARCH_URL=http://127.0.0.1:8765/customsearch/v1
+
+Every response waits `latency` seconds first; streamed completions then send
+one chunk every `token_delay` seconds. Search results link to HTML pages
+served by the stub itself, and /v1/embeddings returns hashed bag-of-words
+vectors, so retrieval runs offline too.
+"""
+import argparse
+import json
+import threading
+import time
+import math
+import re
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_PORT = 8765
+DEFAULT_LATENCY = 0.05  # seconds
+DEFAULT_TOKEN_DELAY = 0.002
+COMPLETION_WORDS = 200
+SEARCH_RESULTS = 10
+PAGE_PARAGRAPHS = 12
+EMBEDDING_DIMENSIONS = 1536
+
+
+def search_items(query, start=1, count=SEARCH_RESULTS, base_url='https://example.com'):
+    return [
+        {
+            'title': f"Result {start + i} for {query}",
+            'link': f"{base_url}/pages/{zlib.crc32(query.encode('utf-8')) % 10_000}/{start + i}",
+            'snippet': f"Snippet {start + i} about {query}. " * 8,
+        }
+        for i in range(count)
+    ]
+
+
+def completion_words(count=COMPLETION_WORDS):
+    return [f"word{i} " for i in range(count)]
+
+
+def page_html(path, paragraphs=PAGE_PARAGRAPHS):
+    body = ''.join(
+        f"<p>Paragraph {i} of {path}. " + ' '.join(f"term{(i * 7 + j) % 50}" for j in range(60)) + "</p>"
+        for i in range(paragraphs)
+    )
+    return (f"<html><head><title>Stub page {path}</title><script>var tracking = 1;</script></head>"
+            f"<body><nav>Home | About</nav><article>{body}</article></body></html>")
+
+
+def embedding(text, dimensions=EMBEDDING_DIMENSIONS):
+    vector = [0.0] * dimensions
+    for word in re.findall(r'\w+', text.casefold()):
+        vector[zlib.crc32(word.encode('utf-8')) % dimensions] += 1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = DEFAULT_LATENCY
+    token_delay = DEFAULT_TOKEN_DELAY
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            # Clients closing pooled keep-alive connections on exit
+            pass
+
+    def _send_json(self, payload, status=200):
+        self._send_body(json.dumps(payload).encode('utf-8'), 'application/json', status)
+
+    def _send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+        if url.path == '/customsearch/v1':
+            params = parse_qs(url.query)
+            query = params.get('q', [''])[0]
+            start = int(params.get('start', ['1'])[0])
+            self._send_json({'items': search_items(query, start, base_url=f"http://{self.headers['Host']}")})
+        elif url.path.startswith('/pages/'):
+            self._send_body(page_html(url.path).encode('utf-8'), 'text/html; charset=utf-8')
+        elif url.path == '/v1/models':
+            self._send_json({'object': 'list', 'data': [{'id': 'gpt-4o-mini', 'object': 'model', 'created': 0, 'owned_by': 'stub'}]})
+        else:
+            self._send_json({'error': {'message': 'not found'}}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        time.sleep(self.latency)
+        if urlparse(self.path).path == '/v1/embeddings':
+            inputs = request.get('input', [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            dimensions = request.get('dimensions') or EMBEDDING_DIMENSIONS
+            self._send_json({
+                'object': 'list', 'model': request.get('model', 'text-embedding-3-small'),
+                'data': [{'object': 'embedding', 'index': i, 'embedding': embedding(text, dimensions)}
+                         for i, text in enumerate(inputs)],
+                'usage': {'prompt_tokens': sum(len(text) // 4 for text in inputs),
+                          'total_tokens': sum(len(text) // 4 for text in inputs)},
+            })
+            return
+        if urlparse(self.path).path != '/v1/chat/completions':
+            self._send_json({'error': {'message': 'not found'}}, status=404)
+            return
+        words = completion_words()
+        prompt_tokens = len(json.dumps(request.get('messages', []))) // 4
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(words),
+                 'total_tokens': prompt_tokens + len(words)}
+        model = request.get('model', 'gpt-4o-mini')
+        if not request.get('stream'):
+            self._send_json({
+                'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(words)},
+                             'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def send_event(data):
+            payload = f"data: {data}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(payload):x}\r\n".encode('ascii') + payload + b'\r\n')
+            self.wfile.flush()
+
+        def chunk(choices, **extra):
+            return json.dumps({'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                               'model': model, 'choices': choices, **extra})
+
+        for i, word in enumerate(words):
+            finish_reason = 'stop' if i == len(words) - 1 else None
+            send_event(chunk([{'index': 0, 'delta': {'content': word}, 'finish_reason': finish_reason}]))
+            time.sleep(self.token_delay)
+        if (request.get('stream_options') or {}).get('include_usage'):
+            send_event(chunk([], usage=usage))
+        send_event('[DONE]')
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+def start_stub_server(port=0, latency=DEFAULT_LATENCY, token_delay=DEFAULT_TOKEN_DELAY):
+    """Serve the stub from a daemon thread; port 0 picks a free port. Returns the server."""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'latency': latency, 'token_delay': token_delay})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_urls(server):
+    host, port = server.server_address[:2]
+    return {
+        'OPENAI_BASE_URL': f"http://{host}:{port}/v1",
+        'GOOGLE_SEARCH_URL': f"http://{host}:{port}/customsearch/v1",
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY)
+    parser.add_argument('--token-delay', type=float, default=DEFAULT_TOKEN_DELAY)
+    args = parser.parse_args()
+    server = start_stub_server(args.port, args.latency, args.token_delay)
+    for name, url in server_urls(server).items():
+        print(f"{name}={url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,21 +1,36 @@
 import streamlit as st
-import pandas as pd
+import functools
 import openai
+from completion_cache import CompletionCache
+from instrumentation import Metrics, render_metrics_panel
+from openai_clients import OpenAIClientRegistry
+from profiler import ProfileCache, render_profile
+from prompt_serializer import serialize_dataframe
+from workbook_cache import WorkbookCache, content_digest
 
 # Input OpenAI API Key
 st.sidebar.subheader("OpenAI API Key")
 api_key = st.sidebar.text_input("Enter your OpenAI API key", type="password")
+# Call metrics shared across reruns and sessions, see instrumentation.Metrics.from_env
+@st.cache_resource
+def get_metrics():
+    return Metrics.from_env()
+
+# Pooled OpenAI clients, one per API key, shared across reruns and sessions
+@st.cache_resource
+def get_openai_clients():
+    return OpenAIClientRegistry()
 @st.cache_data
 def validate_api_key(key):
     """
     Validate the OpenAI API key by making a simple test request.
     """
     try:
-        openai.api_key = key
         # Test request: fetch OpenAI models list
-        openai.models.list()
+        get_openai_clients().get(key).models.list()
         return True, "API key is valid."
     except openai.AuthenticationError:
+        get_openai_clients().discard(key)
         return False, "Invalid API key. Please check and try again."
     except Exception as e:
         return False, f"Error validating API key: {e}"
@@ -27,28 +42,47 @@ if api_key:
     else:
         st.sidebar.error(message)
 
-def summarize_data(df):
-    """Generate a summary of the uploaded data."""
-    summary = {
-        "Shape": df.shape,
-        "Columns": df.columns.tolist(),
-        "Data Types": df.dtypes.to_dict(),
-        "Missing Values": df.isnull().sum().to_dict(),
-    }
-    return summary
-
-def get_openai_insight(prompt):
-    """Send a prompt to OpenAI and return the response."""
+# Parsed sheets cached on disk by file content, shared across reruns and users
+@st.cache_resource
+def get_workbook_cache():
+    return WorkbookCache()
+
+@st.cache_data(max_entries=32)
+def load_first_sheet(file_digest, _file):
+    workbook_cache = get_workbook_cache()
+    sheet_names = workbook_cache.sheet_names(_file.getvalue(), digest=file_digest)
+    return workbook_cache.load_sheet(_file.getvalue(), sheet_names[0], digest=file_digest)
+
+# Prompt text for a sheet, keyed by file content like the sheet itself
+@st.cache_data(max_entries=32)
+def serialize_sheet(file_digest, _df):
+    return serialize_dataframe(_df)
+
+# Column profiles cached on disk by file content, see profiler.ProfileCache
+@st.cache_resource
+def get_profile_cache():
+    return ProfileCache()
+
+# Deterministic completions cached on disk, shared across reruns and users
+@st.cache_resource
+def get_completion_cache():
+    return CompletionCache()
+
+def get_openai_insight(api_key, prompt, temperature=1):
+    """Send a prompt to OpenAI with the user's key and return the response text."""
     try:
-        response = openai.chat.completions.create(
+        response = get_metrics().completion(
+            "openai_insight",
+            functools.partial(get_completion_cache().create, get_openai_clients().get(api_key)),
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are a data analysis assistant."},
                 {"role": "user", "content": prompt},
             ],
             max_tokens=1000,
+            temperature=temperature,
         )
-        return response.choices[0].message
+        return response.choices[0].message.content
     except Exception as e:
         return f"Error: {e}"
 
@@ -59,15 +93,16 @@ uploaded_file = st.file_uploader("Upload an Excel file", type=["xlsx", "xls"])
 
 if uploaded_file:
     try:
-        # Read the Excel file into a DataFrame
-        df = pd.read_excel(uploaded_file)
+        # Read the first sheet into a DataFrame, parsed once per file content
+        file_digest = content_digest(uploaded_file.getvalue())
+        df = load_first_sheet(file_digest, uploaded_file)
 
         st.write("### Dataset Preview")
         st.dataframe(df.head(10))
 
         st.write("### Dataset Summary")
-        summary = summarize_data(df)
-        st.json(summary)
+        # Profiled from the file a chunk at a time, not from the loaded frame
+        render_profile(get_profile_cache().profile(uploaded_file, digest=file_digest))
 
         # Allow the user to request OpenAI insights
         st.write("### OpenAI Analysis")
@@ -77,30 +112,40 @@ if uploaded_file:
             ["Summary of dataset", "Find trends or patterns", "Anomaly detection", "Custom prompt"],
         )
 
-        if prompt_type != "Custom prompt":
-            prompt = (
-                f"Please analyze the following dataset and provide {prompt_type.lower()} insights:\n"
-                f"Columns: {', '.join(df.columns)}\n"
-                f"Data Preview: {df.to_string(index=False)}\n"
-            )
-        else:
+        custom_prompt = ""
+        if prompt_type == "Custom prompt":
             custom_prompt = st.text_area(
                 "Enter your custom analysis request:", placeholder="e.g., Find correlation between columns A and B."
             )
-            if custom_prompt:
-                prompt = (
-                    f"Dataset Columns: {', '.join(df.columns)}\n"
-                    f"Data Preview: {df.to_string(index=False)}\n"
-                    f"Custom Request: {custom_prompt}"
-                )
 
         if st.button("Get Insights from OpenAI"):
-            st.write("### OpenAI Response")
-            with st.spinner("Generating insights..."):
-                insight = get_openai_insight(prompt)
-                st.markdown(insight)
+            if prompt_type == "Custom prompt" and not custom_prompt.strip():
+                st.warning("Please enter a custom analysis request first.")
+            else:
+                # The data is serialized only when an insight is requested, once per file
+                data = serialize_sheet(file_digest, df)
+                if prompt_type != "Custom prompt":
+                    prompt = (
+                        f"Please analyze the following dataset and provide {prompt_type.lower()} insights:\n"
+                        f"Columns: {', '.join(df.columns)}\n"
+                        f"Data:\n{data}\n"
+                    )
+                else:
+                    prompt = (
+                        f"Dataset Columns: {', '.join(df.columns)}\n"
+                        f"Data:\n{data}\n"
+                        f"Custom Request: {custom_prompt}"
+                    )
+                st.write("### OpenAI Response")
+                with st.spinner("Generating insights..."):
+                    # Preset insights are sampled at temperature 0, not the default of 1,
+                    # so they are deterministic and repeat requests come from the cache
+                    insight = get_openai_insight(api_key, prompt, temperature=0 if prompt_type != "Custom prompt" else 1)
+                    st.markdown(insight)
 
     except Exception as e:
         st.error(f"Error processing the file: {e}")
 else:
     st.info("Please upload an Excel file to proceed.")
+
+render_metrics_panel(get_metrics(), cache_stats={"Completion cache": get_completion_cache().stats()})
@@ -1,23 +1,29 @@
+import os
 import streamlit as st
-import pandas as pd
-import numpy as np
-import ssl
-
-ssl._create_default_https_context = ssl._create_unverified_context
+from dataset_mirror import DatasetMirror
 
 st.title('Uber pickups in NYC')
 
 DATE_COLUMN = 'date/time'
-DATA_URL = ('https://s3-us-west-2.amazonaws.com/'
+DATE_FORMAT = '%m/%d/%Y %H:%M:%S'
+# A local path or file:// URL can stand in for the remote file
+DATA_URL = os.environ.get('UBER_DATA_URL', 'https://s3-us-west-2.amazonaws.com/'
          'streamlit-demo-data/uber-raw-data-sep14.csv.gz')
 
+# Downloaded and parsed once into a local columnar mirror, memory-mapped afterwards
+@st.cache_resource
+def get_uber_mirror():
+    return DatasetMirror(
+        DATA_URL,
+        'uber-raw-data-sep14',
+        read_options={'dtype': {'Lat': 'float64', 'Lon': 'float64', 'Base': 'category'}},
+        datetime_formats={DATE_COLUMN: DATE_FORMAT},
+        lowercase_columns=True,
+    )
+
 @st.cache_data
 def load_data(nrows):
-    data = pd.read_csv(DATA_URL, nrows=nrows)
-    lowercase = lambda x: str(x).lower()
-    data.rename(lowercase, axis='columns', inplace=True)
-    data[DATE_COLUMN] = pd.to_datetime(data[DATE_COLUMN])
-    return data
+    return get_uber_mirror().load(nrows)
 
 # Create a text element and let the reader know the data is loading.
 data_load_state = st.text('Loading data...')
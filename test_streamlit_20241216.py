@@ -1,5 +1,18 @@
 import streamlit as st
-from openai import OpenAI
+from chat_render import render_chat_history
+from context_window import build_messages, with_token_count
+from instrumentation import Metrics, render_metrics_panel
+from openai_clients import OpenAIClientRegistry
+
+# Call metrics shared across reruns and sessions, see instrumentation.Metrics.from_env
+@st.cache_resource
+def get_metrics():
+    return Metrics.from_env()
+
+# Pooled OpenAI clients, one per API key, shared across reruns and sessions
+@st.cache_resource
+def get_openai_clients():
+    return OpenAIClientRegistry()
 
 # Show title and description.
 st.title("💬 Chatbot")
@@ -17,35 +30,33 @@ if not openai_api_key:
     st.info("Please add your OpenAI API key to continue.", icon="🗝️")
 else:
 
-    # Create an OpenAI client.
-    client = OpenAI(api_key=openai_api_key)
+    # Reuse the pooled OpenAI client for this key.
+    client = get_openai_clients().get(openai_api_key)
 
     # Create a session state variable to store the chat messages. This ensures that the
     # messages persist across reruns.
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
-    # Display the existing chat messages via `st.chat_message`.
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+    # Display the most recent chat messages via `st.chat_message`. Older messages
+    # are paged in with a "Load older messages" button.
+    render_chat_history(st.session_state.messages, key="chatbot")
 
     # Create a chat input field to allow the user to enter a message. This will display
     # automatically at the bottom of the page.
     if prompt := st.chat_input("What is up?"):
 
         # Store and display the current prompt.
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        st.session_state.messages.append(with_token_count({"role": "user", "content": prompt}))
         with st.chat_message("user"):
             st.markdown(prompt)
 
         # Generate a response using the OpenAI API.
-        stream = client.chat.completions.create(
+        stream = get_metrics().completion(
+            "chat_completion",
+            client.chat.completions.create,
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": m["role"], "content": m["content"]}
-                for m in st.session_state.messages
-            ],
+            messages=build_messages(st.session_state.messages, "gpt-3.5-turbo"),
             stream=True,
         )
 
@@ -53,4 +64,6 @@ else:
         # session state.
         with st.chat_message("assistant"):
             response = st.write_stream(stream)
-        st.session_state.messages.append({"role": "assistant", "content": response})
\ No newline at end of file
+        st.session_state.messages.append(with_token_count({"role": "assistant", "content": response}))
+
+    render_metrics_panel(get_metrics())
@@ -1,9 +1,12 @@
 import streamlit as st
-from openai import OpenAI
-import json
-import os
+from chat_render import render_chat_history
+from chat_store import ChatStore
+from context_window import build_messages, with_token_count
+from instrumentation import Metrics, render_metrics_panel
+from openai_clients import OpenAIClientRegistry
 
 DB_FILE = 'db.json'
+DB_DIR = 'chat_db'
 
 # Default prompt that cannot be adjusted by the user
 DEFAULT_PROMPT = (
@@ -16,8 +19,23 @@ DEFAULT_PROMPT = (
             "Always site your source of information if possible, do not make up false information."
 )
 
+# Chat store shared across reruns and users, flushing appends in the background
+@st.cache_resource
+def get_chat_store():
+    return ChatStore(DB_DIR, legacy_db_file=DB_FILE, write_behind=True)
+
+# Call metrics shared across reruns and sessions, see instrumentation.Metrics.from_env
+@st.cache_resource
+def get_metrics():
+    return Metrics.from_env()
+
+# Pooled OpenAI clients, one per API key, shared across reruns and sessions
+@st.cache_resource
+def get_openai_clients():
+    return OpenAIClientRegistry()
+
 def main():
-    client = OpenAI(api_key=st.session_state.openai_api_key)
+    client = get_openai_clients().get(st.session_state.openai_api_key)
 
     # List of models
     models = ["gpt-4o-mini", "gpt-4o", "gpt-4-turbo", "gpt-4", "gpt-3.5-turbo"]
@@ -25,20 +43,15 @@ def main():
     # Create a select box for the models
     st.session_state["openai_model"] = st.sidebar.selectbox("Select OpenAI model", models, index=0)
 
-    # Load chat history from db.json
-    with open(DB_FILE, 'r') as file:
-        db = json.load(file)
-
-    # Initialize chat_sessions if not present
-    if 'chat_sessions' not in db:
-        db['chat_sessions'] = {}
+    # Chat store, importing an existing db.json on first run
+    store = get_chat_store()
 
     # If 'active_session' not in session_state, set it to 0 (first session)
     if 'active_session' not in st.session_state:
         st.session_state['active_session'] = 0
 
     # Display existing chat sessions
-    session_names = list(db['chat_sessions'].keys())
+    session_names = store.session_names()
     selected_session = st.sidebar.selectbox(
         "Select Chat Session", 
         options=session_names + ["New Chat"], 
@@ -52,92 +65,78 @@ def main():
             value=selected_session,
             max_chars=50
         )
-        if new_session_name and new_session_name != selected_session:
-            # Rename the session in the db
-            db['chat_sessions'][new_session_name] = db['chat_sessions'].pop(selected_session)
-            with open(DB_FILE, 'w') as file:
-                json.dump(db, file)
-            st.session_state['active_session'] = list(db['chat_sessions'].keys()).index(new_session_name)
+        if new_session_name in session_names and new_session_name != selected_session:
+            st.error(f"A session named '{new_session_name}' already exists.")
+        elif new_session_name and new_session_name != selected_session:
+            # Rename the session in the index, the session log itself is untouched
+            store.rename_session(selected_session, new_session_name)
+            st.session_state['active_session'] = store.session_names().index(new_session_name)
             st.success(f"Session renamed to '{new_session_name}'")
             st.rerun()
 
     # Handle creating a new chat session
     if selected_session == "New Chat":
-        new_session_id = str(len(db['chat_sessions']))
-        st.session_state['active_session'] = len(db['chat_sessions'])
-        db['chat_sessions'][new_session_id] = []  # New chat history for the session
-        with open(DB_FILE, 'w') as file:
-            json.dump(db, file)
+        new_session_number = len(session_names)
+        while str(new_session_number) in session_names:
+            new_session_number += 1
+        st.session_state['active_session'] = len(session_names)
+        # New chat history for the session, starting with the default prompt
+        store.create_session(str(new_session_number), [{"role": "system", "content": DEFAULT_PROMPT}])
         st.rerun()
 
     # Get the active session's chat history
-    chat_history = db['chat_sessions'][session_names[st.session_state['active_session']]]
+    active_session_name = session_names[st.session_state['active_session']]
+    chat_history = store.load_session(active_session_name)
 
-    # If it's a new session, add the default prompt (system message)
+    # Sessions imported from db.json may lack the default prompt (system message)
     if not any(m["role"] == "system" for m in chat_history):  # Avoid adding multiple system instructions
         chat_history.insert(0, {"role": "system", "content": DEFAULT_PROMPT})
-        with open(DB_FILE, 'w') as file:
-            json.dump(db, file)
+        store.reset_session(active_session_name, chat_history)
         st.rerun()
 
-    # Display chat messages from the selected session, excluding system messages
-    for message in chat_history:
-        if message["role"] != "system":  # Skip displaying system messages
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
+    # Display the most recent chat messages from the selected session, excluding system messages
+    render_chat_history(chat_history, key=active_session_name)
 
     # Accept user input
     if prompt := st.chat_input("Please ask a question:"):
         # Add user message to chat history
-        chat_history.append({"role": "user", "content": prompt})
+        chat_history.append(with_token_count({"role": "user", "content": prompt}))
+        store.append_message(active_session_name, chat_history[-1])
         # Display user message in chat message container
         with st.chat_message("user"):
             st.markdown(prompt)
 
         # Display assistant response in chat message container
         with st.chat_message("assistant"):
-            stream = client.chat.completions.create(
+            stream = get_metrics().completion(
+                "chat_completion",
+                client.chat.completions.create,
                 model=st.session_state["openai_model"],
-                messages=[{"role": m["role"], "content": m["content"]} for m in chat_history],
+                messages=build_messages(chat_history, st.session_state["openai_model"]),
                 stream=True,
             )
             response = st.write_stream(stream)
-        chat_history.append({"role": "assistant", "content": response})
-
-        # Store updated chat history in db.json
-        db['chat_sessions'][session_names[st.session_state['active_session']]] = chat_history
-        with open(DB_FILE, 'w') as file:
-            json.dump(db, file)
+        chat_history.append(with_token_count({"role": "assistant", "content": response}))
+        store.append_message(active_session_name, chat_history[-1])
 
     # Add a "Clear Chat" button to the sidebar for the current session
     if st.sidebar.button('Clear Chat'):
-        db['chat_sessions'][session_names[st.session_state['active_session']]] = []
-        with open(DB_FILE, 'w') as file:
-            json.dump(db, file)
+        store.reset_session(active_session_name, [{"role": "system", "content": DEFAULT_PROMPT}])
         st.rerun()
 
+    render_metrics_panel(get_metrics())
+
 if __name__ == '__main__':
     if 'openai_api_key' in st.session_state and st.session_state.openai_api_key:
         main()
     else:
-        # if the DB_FILE not exists, create it
-        if not os.path.exists(DB_FILE):
-            with open(DB_FILE, 'w') as file:
-                db = {
-                    'openai_api_keys': [],
-                    'chat_sessions': {}
-                }
-                json.dump(db, file)
-
-        # load the database
-        else:
-            with open(DB_FILE, 'r') as file:
-                db = json.load(file)
-
-        # display the selectbox from db['openai_api_keys']
+        # open the chat store, importing an existing DB_FILE on first run
+        store = get_chat_store()
+
+        # display the selectbox from the stored OpenAI API keys
         selected_key = st.selectbox(
             label="Existing OpenAI API Keys", 
-            options=db['openai_api_keys']
+            options=store.api_keys()
         )
 
         # a text input box for entering a new key
@@ -148,13 +147,11 @@ if __name__ == '__main__':
 
         login = st.button("Login")
 
-        # if new_key is given, add it to db['openai_api_keys']
+        # if new_key is given, add it to the stored OpenAI API keys
         # if new_key is not given, use the selected_key
         if login:
             if new_key:
-                db['openai_api_keys'].append(new_key)
-                with open(DB_FILE, 'w') as file:
-                    json.dump(db, file)
+                store.add_api_key(new_key)
                 st.success("Key saved successfully.")
                 st.session_state['openai_api_key'] = new_key
                 st.rerun()
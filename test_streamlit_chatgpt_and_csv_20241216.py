@@ -1,23 +1,40 @@
 import streamlit as st
-from openai import OpenAI
 import json
-import os
-import pandas as pd
+from chat_render import render_chat_history
+from context_window import build_messages
+from data_loader import file_kind, load_arrow_table, read_preview
+from dataframe_preview import TablePreview, render_table_preview
+from instrumentation import Metrics, render_metrics_panel
+from openai_clients import OpenAIClientRegistry
+from prompt_serializer import serialize_dataframe
 
 DB_FILE = 'db.json'
 
-# Function to load and display file content
-def load_file(file):
-    if file.name.endswith('.csv'):
-        return pd.read_csv(file)
-    elif file.name.endswith(('.xls', '.xlsx')):
-        return pd.read_excel(file)
-    else:
-        st.error("Unsupported file format. Please upload a CSV or Excel file.")
-        return None
+# The first rows of an upload, read once whatever the file size. Uploads are keyed
+# by their file_id, so reruns never hash the file's content.
+@st.cache_data(max_entries=4)
+def load_preview(file_id, _file):
+    return read_preview(_file)
+
+# An upload loaded once into a server-side Arrow table. Column selections are views
+# of it and reruns only read pages.
+@st.cache_resource(max_entries=4)
+def load_table(file_id, _file):
+    table, load_stats = load_arrow_table(_file)
+    return TablePreview(table), load_stats
+
+# Call metrics shared across reruns and sessions, see instrumentation.Metrics.from_env
+@st.cache_resource
+def get_metrics():
+    return Metrics.from_env()
+
+# Pooled OpenAI clients, one per API key, shared across reruns and sessions
+@st.cache_resource
+def get_openai_clients():
+    return OpenAIClientRegistry()
 
 def main():
-    client = OpenAI(api_key=st.session_state.openai_api_key)
+    client = get_openai_clients().get(st.session_state.openai_api_key)
 
     # List of models
     models = ["gpt-4o-mini", "gpt-4o", "gpt-4-turbo", "gpt-4", "gpt-3.5-turbo"]
@@ -36,40 +53,48 @@ def main():
         db = json.load(file)
     st.session_state.messages = db.get('chat_history', [])
 
-    # Display chat messages from history on app rerun
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+    # Display the most recent chat messages from history on app rerun
+    render_chat_history(st.session_state.messages, key="chat_history")
 
     # File upload section
     uploaded_file = st.file_uploader("Upload your CSV or Excel file for analysis", type=["csv", "xls", "xlsx"])
     if uploaded_file:
-        data = load_file(uploaded_file)
-        if data is not None:
+        if file_kind(uploaded_file) is None:
+            st.error("Unsupported file format. Please upload a CSV or Excel file.")
+        else:
+            preview = load_preview(uploaded_file.file_id, uploaded_file)
             st.write("**Preview of the uploaded file:**")
-            st.dataframe(data)
+            st.dataframe(preview)
+            st.caption(f"First {len(preview):,} rows; the whole file is loaded once columns are selected.")
 
             # Ask user for columns to analyze
-            selected_columns = st.multiselect("Select columns to analyze", options=data.columns.tolist())
+            selected_columns = st.multiselect("Select columns to analyze", options=list(preview.columns))
             if selected_columns:
                 st.write("**Selected data for analysis:**")
-                filtered_data = data[selected_columns]
-                st.dataframe(filtered_data)
+                table, load_stats = load_table(uploaded_file.file_id, uploaded_file)
+                # A view of the selected columns, nothing is copied
+                selection = table.select(selected_columns)
+                render_table_preview(selection, key="selection")
+                st.caption(
+                    f"Loaded {load_stats['Rows']:,} rows of {load_stats['Columns']} columns "
+                    f"using {load_stats['Memory (bytes)'] / 2**20:.1f} MB."
+                )
 
                 # User prompt for specific questions about the data
                 data_prompt = st.text_area("Ask a question or describe the analysis you want:")
                 if st.button("Analyze Data"):
-                    st.session_state.messages.append({"role": "user", "content": f"Analyze the following data: {filtered_data.to_dict()}\n{data_prompt}"})
+                    # A bounded summary and sample of the data rather than every row
+                    data_message = f"Analyze the following data:\n{serialize_dataframe(selection.to_pandas())}\n{data_prompt}"
+                    st.session_state.messages.append({"role": "user", "content": data_message})
                     with st.chat_message("user"):
-                        st.markdown(f"Analyze the following data: {filtered_data.to_dict()}\n{data_prompt}")
+                        st.markdown(data_message)
 
                     with st.chat_message("assistant"):
-                        stream = client.chat.completions.create(
+                        stream = get_metrics().completion(
+                            "chat_completion",
+                            client.chat.completions.create,
                             model=st.session_state["openai_model"],
-                            messages=[
-                                {"role": m["role"], "content": m["content"]}
-                                for m in st.session_state.messages
-                            ],
+                            messages=build_messages(st.session_state.messages, st.session_state["openai_model"]),
                             stream=True,
                         )
                         response = st.write_stream(stream)
@@ -87,12 +112,11 @@ def main():
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            stream = client.chat.completions.create(
+            stream = get_metrics().completion(
+                "chat_completion",
+                client.chat.completions.create,
                 model=st.session_state["openai_model"],
-                messages=[
-                    {"role": m["role"], "content": m["content"]}
-                    for m in st.session_state.messages
-                ],
+                messages=build_messages(st.session_state.messages, st.session_state["openai_model"]),
                 stream=True,
             )
             response = st.write_stream(stream)
@@ -103,6 +127,8 @@ def main():
         with open(DB_FILE, 'w') as file:
             json.dump(db, file)
 
+    render_metrics_panel(get_metrics())
+
 if __name__ == '__main__':
     st.session_state['openai_api_key'] = st.text_input("Enter your OpenAI API Key", type="password")
     if st.session_state['openai_api_key']:
@@ -1,25 +1,36 @@
 import streamlit as st
-import pandas as pd
 import openai
-import openpyxl
-import ssl
+from exporter import EXPORT_FORMATS, Exporter, export_button
+from instrumentation import Metrics, render_metrics_panel
+from openai_clients import OpenAIClientRegistry
+from prompt_serializer import serialize_dataframe
+from workbook_cache import WorkbookCache, content_digest
+from workbook_ingest import ingest_sheets
 # ssl._create_default_https_context = ssl._create_unverified_context
 # App Title
 st.title("Excel File Analyzer with OpenAI")
 # Input OpenAI API Key
 st.sidebar.subheader("OpenAI API Key")
 api_key = st.sidebar.text_input("Enter your OpenAI API key", type="password")
+# Call metrics shared across reruns and sessions, see instrumentation.Metrics.from_env
+@st.cache_resource
+def get_metrics():
+    return Metrics.from_env()
+# Pooled OpenAI clients, one per API key, shared across reruns and sessions
+@st.cache_resource
+def get_openai_clients():
+    return OpenAIClientRegistry()
 @st.cache_data
 def validate_api_key(key):
     """
     Validate the OpenAI API key by making a simple test request.
     """
     try:
-        openai.api_key = key
         # Test request: fetch OpenAI models list
-        openai.models.list()
+        get_openai_clients().get(key).models.list()
         return True, "API key is valid."
     except openai.AuthenticationError:
+        get_openai_clients().discard(key)
         return False, "Invalid API key. Please check and try again."
     except Exception as e:
         return False, f"Error validating API key: {e}"
@@ -32,53 +43,73 @@ if api_key:
         st.sidebar.error(message)
 # File Upload
 uploaded_file = st.file_uploader("Upload your Excel file", type=["xlsx", "xls"])
-@st.cache_data
-def load_excel(file, sheet_name):
-    return pd.read_excel(file, sheet_name=sheet_name)
+# Parsed sheets cached on disk by file content, shared across reruns and users
+@st.cache_resource
+def get_workbook_cache():
+    return WorkbookCache()
+# Download files built on demand, cached on disk by sheet content and format
+@st.cache_resource
+def get_exporter():
+    return Exporter()
+@st.cache_data(max_entries=32)
+def load_excel(file_digest, sheet_name, _file):
+    return get_workbook_cache().load_sheet(_file.getvalue(), sheet_name, digest=file_digest)
 if uploaded_file:
     # Read the Excel file into a DataFrame
     try:
-        excel_data = pd.ExcelFile(uploaded_file)
-        sheet_names = excel_data.sheet_names
+        file_digest = content_digest(uploaded_file.getvalue())
+        sheet_names = get_workbook_cache().sheet_names(uploaded_file.getvalue(), digest=file_digest)
+        # Optionally parse many sheets up front, in parallel, so switching sheets is instant
+        if len(sheet_names) > 1:
+            with st.expander("Load several sheets in parallel"):
+                sheets_to_load = st.multiselect("Sheets to load", sheet_names, default=sheet_names)
+                if st.button("Load sheets") and sheets_to_load:
+                    progress = st.progress(0.0, text="Parsing sheets...")
+                    sheet_tables = ingest_sheets(uploaded_file.getvalue(), sheets_to_load, cache=get_workbook_cache())
+                    for loaded, (loaded_sheet, sheet) in enumerate(sheet_tables, start=1):
+                        progress.progress(
+                            loaded / len(sheets_to_load),
+                            text=f"Loaded '{loaded_sheet}' ({len(sheet):,} rows), {loaded}/{len(sheets_to_load)}",
+                        )
         # Let the user pick a sheet
         sheet_name = st.selectbox("Select a sheet to read", sheet_names)
         # Load the selected sheet
         if sheet_name:
-            df = load_excel(uploaded_file, sheet_name=sheet_name)
+            df = load_excel(file_digest, sheet_name, uploaded_file)
             st.success(f"Sheet '{sheet_name}' loaded successfully!")
         
             # Display the first few rows of the DataFrame
             st.subheader("Data Preview")
             st.write(df.head())
         
-            # Option to download uploaded content as CSV
-            csv = df.to_csv(index=False)
-            st.download_button(
-                label="Download as CSV",
-                data=csv,
-                file_name='uploaded_file.csv',
-                mime='text/csv',
+            # Option to download the sheet, only serialized when a download is clicked
+            export_format = st.radio(
+                "Download format", list(EXPORT_FORMATS), horizontal=True,
+                format_func=lambda fmt: EXPORT_FORMATS[fmt][0],
             )
+            export_button(get_exporter(), df, f"{file_digest}:{sheet_name}", 'uploaded_file', export_format)
             # User input question for OpenAI
             if api_key:
                 st.subheader("Feel free to ask a question about the data")
                 user_question = st.text_input("Your Question")
                 if user_question:
-                    # Convert DataFrame to JSON
-                    table_json = df.to_dict(orient="records")
+                    # Summarize the DataFrame within a bounded token budget
+                    table_summary = serialize_dataframe(df)
                     # OpenAI query
                     with st.spinner("Analyzing your question..."):
                         try:
-                            response = openai.chat.completions.create(
+                            response = get_metrics().completion(
+                                "table_question",
+                                get_openai_clients().get(api_key).chat.completions.create,
                                 model="gpt-4o",  # Or use "gpt-4" if available
                                 messages=[
                                     {"role": "system", "content": "You are a data analysis assistant."},
-                                    {"role": "user", "content": f"Here is a table in JSON format:\n{table_json}\n\nQuestion: {user_question}"}
+                                    {"role": "user", "content": f"Here is a summary and sample of a table:\n{table_summary}\n\nQuestion: {user_question}"}
                                 ]
                             )
                             # Display the response
                             st.subheader("OpenAI Response")
-                            st.write(response['choices'][0]['message']['content'])
+                            st.write(response.choices[0].message.content)
                         except Exception as e:
                             st.error(f"Error communicating with OpenAI: {e}")
             elif not is_valid:
@@ -87,3 +118,5 @@ if uploaded_file:
         st.error(f"Error reading file: {e}")
 else:
     st.info("Awaiting file upload.")
+
+render_metrics_panel(get_metrics())
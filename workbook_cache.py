@@ -0,0 +1,149 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+CACHE_DIR = '.workbook_cache'
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+MANIFEST_FILE = 'manifest.json'
+
+
+def content_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class WorkbookCache:
+    """
+    On-disk cache of parsed Excel workbooks keyed on a hash of the file
+    bytes. Each sheet is stored as Parquet (pickle when a sheet has columns
+    Arrow can't represent, or pyarrow isn't installed), so re-uploads of the
+    same file and sheet switches never re-parse the XLSX. Whole workbooks
+    are evicted least recently used first once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _workbook_dir(self, digest):
+        return os.path.join(self.root, digest)
+
+    def _touch(self, digest):
+        # The workbook directory's mtime doubles as its last access time
+        try:
+            os.utime(self._workbook_dir(digest))
+        except FileNotFoundError:
+            pass
+
+    def sheet_names(self, data, digest=None):
+        digest = digest or content_digest(data)
+        manifest_path = os.path.join(self._workbook_dir(digest), MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as file:
+                manifest = json.load(file)
+            self._touch(digest)
+            return manifest['sheet_names']
+
+        sheet_names = pd.ExcelFile(io.BytesIO(data)).sheet_names
+        os.makedirs(self._workbook_dir(digest), exist_ok=True)
+        tmp_path = f"{manifest_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({'sheet_names': sheet_names, 'size': len(data)}, file)
+        os.replace(tmp_path, manifest_path)
+        return sheet_names
+
+    def _sheet_path(self, digest, sheet_names, sheet_name, suffix):
+        # Sheets are stored by position, sheet names aren't safe file names
+        return os.path.join(self._workbook_dir(digest), f"{sheet_names.index(sheet_name)}.{suffix}")
+
+    def get_sheet(self, digest, sheet_names, sheet_name):
+        """Return the cached sheet, or None if it hasn't been parsed yet."""
+        parquet_path = self._sheet_path(digest, sheet_names, sheet_name, 'parquet')
+        pickle_path = self._sheet_path(digest, sheet_names, sheet_name, 'pkl')
+        if os.path.exists(parquet_path):
+            self._touch(digest)
+            return pd.read_parquet(parquet_path)
+        if os.path.exists(pickle_path):
+            self._touch(digest)
+            return pd.read_pickle(pickle_path)
+        return None
+
+    def get_table(self, digest, sheet_names, sheet_name):
+        """
+        Return the cached sheet as a memory-mapped Arrow table, as a
+        DataFrame when it was stored as pickle, or None if it hasn't been
+        parsed yet.
+        """
+        parquet_path = self._sheet_path(digest, sheet_names, sheet_name, 'parquet')
+        if pyarrow is not None and os.path.exists(parquet_path):
+            self._touch(digest)
+            return pq.read_table(parquet_path, memory_map=True)
+        pickle_path = self._sheet_path(digest, sheet_names, sheet_name, 'pkl')
+        if os.path.exists(pickle_path):
+            self._touch(digest)
+            return pd.read_pickle(pickle_path)
+        return None
+
+    def put_table(self, digest, sheet_names, sheet_name, table):
+        parquet_path = self._sheet_path(digest, sheet_names, sheet_name, 'parquet')
+        tmp_path = f"{parquet_path}.{threading.get_ident()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, parquet_path)
+        self.evict()
+
+    def put_sheet(self, digest, sheet_names, sheet_name, df):
+        parquet_path = self._sheet_path(digest, sheet_names, sheet_name, 'parquet')
+        pickle_path = self._sheet_path(digest, sheet_names, sheet_name, 'pkl')
+        tmp_path = f"{parquet_path}.{threading.get_ident()}.tmp"
+        try:
+            if pyarrow is None:
+                raise ImportError('pyarrow is not installed')
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, parquet_path)
+        except (ImportError, ValueError, TypeError, getattr(pyarrow, 'ArrowException', ValueError)):
+            # e.g. object columns mixing numbers and text
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, pickle_path)
+        self.evict()
+
+    def load_sheet(self, data, sheet_name, digest=None):
+        digest = digest or content_digest(data)
+        sheet_names = self.sheet_names(data, digest)
+        df = self.get_sheet(digest, sheet_names, sheet_name)
+        if df is None:
+            df = pd.read_excel(io.BytesIO(data), sheet_name=sheet_name)
+            # Parquet needs string column names, keep fresh and cached loads identical
+            df.columns = df.columns.map(str)
+            self.put_sheet(digest, sheet_names, sheet_name, df)
+        return df
+
+    def evict(self):
+        with self._lock:
+            workbooks = []
+            total_bytes = 0
+            for digest in os.listdir(self.root):
+                path = self._workbook_dir(digest)
+                if not os.path.isdir(path):
+                    continue
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+                workbooks.append((os.stat(path).st_mtime, size, path))
+                total_bytes += size
+            for _, size, path in sorted(workbooks):
+                if total_bytes <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total_bytes -= size
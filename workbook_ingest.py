@@ -0,0 +1,84 @@
+import io
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+
+from workbook_cache import content_digest
+
+MAX_WORKERS = os.cpu_count() or 1
+
+_workbook_data = None
+
+
+def _init_worker(data):
+    # Each worker receives the workbook bytes once instead of once per sheet
+    global _workbook_data
+    _workbook_data = data
+
+
+def _parse_sheet(sheet_name):
+    df = pd.read_excel(io.BytesIO(_workbook_data), sheet_name=sheet_name)
+    df.columns = df.columns.map(str)
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Columns mixing numbers and text can't be typed by Arrow, keep them as-is
+        # and let the cache store the sheet as pickle, exactly as WorkbookCache.load_sheet does
+        return sheet_name, 'pickle', pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+    # Ship the table as an Arrow IPC stream, much cheaper to serialize than a pickled DataFrame
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sheet_name, 'arrow', sink.getvalue().to_pybytes()
+
+
+def _read_ipc(payload):
+    return pa.ipc.open_stream(pa.py_buffer(payload)).read_all()
+
+
+def ingest_sheets(data, sheet_names=None, cache=None, max_workers=MAX_WORKERS):
+    """
+    Parse several sheets of a workbook in parallel worker processes and
+    yield (sheet_name, sheet) as each one lands, so callers can report
+    progress. A sheet is a pyarrow.Table, or a DataFrame when it has
+    columns Arrow can't type. sheet_names defaults to every sheet. With a
+    WorkbookCache, already cached sheets are served from disk and newly
+    parsed ones are stored in the same format WorkbookCache.load_sheet uses.
+    """
+    digest = content_digest(data)
+    all_sheet_names = cache.sheet_names(data, digest) if cache is not None else pd.ExcelFile(io.BytesIO(data)).sheet_names
+    sheet_names = list(sheet_names) if sheet_names is not None else all_sheet_names
+
+    to_parse = []
+    for sheet_name in sheet_names:
+        sheet = cache.get_table(digest, all_sheet_names, sheet_name) if cache is not None else None
+        if sheet is None:
+            to_parse.append(sheet_name)
+        else:
+            yield sheet_name, sheet
+    if not to_parse:
+        return
+
+    # Spawned workers don't inherit the Streamlit server's threads and locks
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(to_parse)),
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(data,),
+    ) as executor:
+        futures = [executor.submit(_parse_sheet, sheet_name) for sheet_name in to_parse]
+        for future in as_completed(futures):
+            sheet_name, kind, payload = future.result()
+            if kind == 'arrow':
+                sheet = _read_ipc(payload)
+                if cache is not None:
+                    cache.put_table(digest, all_sheet_names, sheet_name, sheet)
+            else:
+                sheet = pickle.loads(payload)
+                if cache is not None:
+                    cache.put_sheet(digest, all_sheet_names, sheet_name, sheet)
+            yield sheet_name, sheet